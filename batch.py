@@ -0,0 +1,175 @@
+import logging
+import multiprocessing
+import os
+import types
+
+import owlready2
+
+import ig
+import rules
+from builder import OntologyBuilder
+from preprocessing import check_annotations, read_annotations, split_statements
+
+logger = logging.getLogger(__name__)
+
+THING = "owl:Thing"
+
+
+def document_name(input_annotation_path):
+    return os.path.splitext(os.path.basename(input_annotation_path))[0]
+
+
+def check_document_names(input_annotation_paths):
+    # statement numbers are prefixed with the document name
+    names = [document_name(path) for path in input_annotation_paths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Document names must be unique: {names}")
+
+
+def qualify(document, stmt_no):
+    return f"{document}:{stmt_no}"
+
+
+def build_document(input_annotation_path, input_format=None, skiprows=1):
+    # Runs in a worker process, returns plain data only.
+    df = read_annotations(input_annotation_path, input_format, skiprows)
+    check_annotations(df)
+    _, _, df_reg_observation, _ = split_statements(df)
+    non_unique = set(df_reg_observation[ig.STMT_NO])
+    with OntologyBuilder() as builder:
+        builder.build_entities(df)
+        builder.build_rules(df)
+        classes = [
+            (c.name, [THING if p is owlready2.Thing else p.name for p in c.is_a])
+            for c in builder.onto.classes()
+        ]
+        class_sources = [
+            (
+                stmt_no,
+                c.name,
+                None if p is None else THING if p is owlready2.Thing else p.name,
+            )
+            for stmt_no, entries in builder.statement_no_to_classes.items()
+            for c, p in entries
+        ]
+        relations = [
+            (stmt_no, s.name, relation_name, o.name, stmt_no not in non_unique)
+            for stmt_no, entries in builder.statement_no_to_realtion.items()
+            for s, relation_name, o in entries
+        ]
+        batch = builder.rule_batch
+        rule_atoms = [
+            (body, head, sorted(batch.sources.get(key, ())))
+            for key, (body, head) in batch.rules.items()
+        ]
+    return (
+        document_name(input_annotation_path),
+        classes,
+        class_sources,
+        relations,
+        rule_atoms,
+    )
+
+
+def merge_document(builder, document, classes, class_sources, relations, rule_atoms):
+    # replays the document into builder, so relation suffixes are allocated
+    # as if the documents were one sheet
+    # a class can get a parent created after it, so every class exists before
+    # the parents are set
+    new_classes = set()
+    with builder.onto:
+        for name, _ in classes:
+            if name not in builder.class_index:
+                new_classes.add(name)
+                builder.class_index[name] = types.new_class(name, (owlready2.Thing,))
+    for name, parents in classes:
+        cls = builder.class_index[name]
+        parents = [
+            owlready2.Thing if parent == THING else builder.class_index[parent]
+            for parent in parents
+        ]
+        if name in new_classes:
+            cls.is_a = parents
+        else:
+            cls.is_a.extend([parent for parent in parents if parent not in cls.is_a])
+
+    for stmt_no, name, parent in class_sources:
+        if parent is not None:
+            parent = owlready2.Thing if parent == THING else builder.class_index[parent]
+        builder.statement_no_to_classes.append(
+            qualify(document, stmt_no), builder.class_index[name], parent
+        )
+
+    # (document statement number, document relation name) -> merged name
+    merged_relation_names = {}
+    for stmt_no, subject, relation_name, object, unique in relations:
+        subject = builder.class_index[subject]
+        qualified = None if stmt_no is None else qualify(document, stmt_no)
+        builder.define_relationship(
+            subject,
+            relation_name.rstrip("'") if unique else relation_name,
+            builder.class_index[object],
+            statement_no=qualified,
+            unique_relation=unique,
+        )
+        _, merged_name, _ = builder.statement_no_to_realtion.latest(qualified)
+        merged_relation_names[stmt_no, relation_name] = merged_name
+
+    def merged_atoms(atoms, stmt_nos):
+        # relation atoms take the merged name of the statement they come from
+        merged = []
+        for name, args in atoms:
+            if len(args) == 2:
+                name = next(
+                    (
+                        merged_relation_names[stmt_no, name]
+                        for stmt_no in stmt_nos
+                        if (stmt_no, name) in merged_relation_names
+                    ),
+                    name,
+                )
+            merged.append((name, args))
+        return tuple(merged)
+
+    for body, head, sources in rule_atoms:
+        body = merged_atoms(body, [a for a, _ in sources])
+        head = merged_atoms(head, [c for _, c in sources])
+        builder.add_rule(
+            rules.format_rule(body, head),
+            *[(qualify(document, a), qualify(document, c)) for a, c in sources],
+        )
+
+
+def build_documents(
+    input_annotation_paths,
+    output_ontology_path="ig.owl",
+    processes=None,
+    input_format=None,
+    skiprows=1,
+    structured_provenance=False,
+    output_format=None,
+    sort_output=False,
+    output_base=None,
+    provenance_index=None,
+):
+    check_document_names(input_annotation_paths)
+    with multiprocessing.Pool(processes) as pool:
+        documents = pool.starmap(
+            build_document,
+            [(path, input_format, skiprows) for path in input_annotation_paths],
+            chunksize=1,
+        )
+    with OntologyBuilder() as builder:
+        for document in documents:
+            logger.info(f"Merging {document[0]}")
+            merge_document(builder, *document)
+        builder.flush_rules()
+        builder.save(
+            output_ontology_path,
+            structured_provenance,
+            output_format,
+            sort_output,
+            output_base,
+        )
+        if provenance_index is not None:
+            builder.save_provenance_index(provenance_index)
@@ -0,0 +1,179 @@
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional
+
+import typer
+
+from benchmarks import generate
+
+logger = logging.getLogger(__name__)
+
+app = typer.Typer()
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+# stages shown by run, all stages are stored
+summary_stages = ["read", "check", "flush_rules", "save"]
+
+
+def time_stages(input_annotation_path):
+    # runs in a fresh process, so peak RSS belongs to this build alone
+    logging.disable(logging.WARNING)
+    from builder import OntologyBuilder
+    from metrics import BuildMetrics, peak_rss_bytes
+    from preprocessing import check_annotations, read_annotations
+
+    metrics = BuildMetrics()
+    with metrics.stage("read"):
+        df = read_annotations(input_annotation_path)
+    with metrics.stage("check"):
+        check_annotations(df)
+    output = os.path.join(tempfile.mkdtemp(), "ig.owl")
+    with OntologyBuilder(metrics=metrics) as builder:
+        builder.build(df)
+        builder.save(output)
+        counts = {
+            "rows": len(df),
+            "classes": len(builder.class_index),
+            "relations": len(builder.relation_registry.defined),
+        }
+    shutil.rmtree(os.path.dirname(output))
+    counts.update(
+        {
+            name: value
+            for (name, labels), value in metrics.counters.items()
+            if not labels
+        }
+    )
+    timings = {record["stage"]: record["seconds"] for record in metrics.stages}
+    return {
+        "stages": timings,
+        "total": sum(timings.values()),
+        "peak_rss_mb": peak_rss_bytes() / (1024 * 1024),
+        "counts": counts,
+    }
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=benchmarks_dir, capture_output=True, text=True
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD")
+    dirty = git("status", "--porcelain", "--untracked-files=no") != ""
+    return commit, dirty
+
+
+def synthetic_sheet(data_dir, statements, seed, input_format, and_ratio):
+    os.makedirs(data_dir, exist_ok=True)
+    name = f"synthetic-{statements}-{seed}-and{and_ratio:g}.{input_format}"
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        logger.info(f"Generating {path}")
+        generate.main(statements, path, seed=seed, and_ratio=and_ratio)
+    return path
+
+
+@app.command()
+def run(
+    sizes: str = "1000,10000",
+    repeat: int = 1,
+    seed: int = 0,
+    input_format: str = "xlsx",
+    and_ratio: float = generate.default_and_ratio,
+    data_dir: str = os.path.join(benchmarks_dir, "data"),
+    results: str = os.path.join(benchmarks_dir, "results.jsonl"),
+):
+    commit, dirty = git_revision()
+    for statements in [int(size) for size in sizes.split(",")]:
+        path = synthetic_sheet(data_dir, statements, seed, input_format, and_ratio)
+        for i in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(time_stages, path).result()
+            record = {
+                "commit": commit,
+                "dirty": dirty,
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "statements": statements,
+                "seed": seed,
+                "input_format": input_format,
+                "and_ratio": and_ratio,
+                **result,
+            }
+            with open(results, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            stage_times = ", ".join(
+                f"{s} {result['stages'][s]:.2f}s" for s in summary_stages
+            )
+            typer.echo(
+                f"{statements} statements: {stage_times}, total {result['total']:.2f}s, "
+                f"peak RSS {result['peak_rss_mb']:.0f}MB"
+            )
+
+
+@app.command()
+def compare(
+    base: Optional[str] = None,
+    head: Optional[str] = None,
+    results: str = os.path.join(benchmarks_dir, "results.jsonl"),
+):
+    # medians per commit, sheet and size; base and head default to the last
+    # two commits found in the results. Runs recorded before and_ratio was
+    # stored had no AND references.
+    runs = defaultdict(list)
+    commits = []
+    with open(results, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            key = (
+                record["commit"],
+                record["input_format"],
+                record.get("and_ratio", 0.0),
+                record["statements"],
+            )
+            runs[key].append(record)
+            if record["commit"] not in commits:
+                commits.append(record["commit"])
+    if head is None:
+        head = commits[-1]
+    if base is None:
+        earlier = [commit for commit in commits if commit != head]
+        if len(earlier) == 0:
+            raise typer.BadParameter("Results have a single commit, pass --base")
+        base = earlier[-1]
+
+    typer.echo(f"{base} -> {head}")
+    for commit, input_format, and_ratio, statements in sorted(runs, key=lambda k: k[3]):
+        if commit != head or (base, input_format, and_ratio, statements) not in runs:
+            continue
+        typer.echo(f"{statements} statements ({input_format}, AND ratio {and_ratio:g})")
+        base_runs = runs[(base, input_format, and_ratio, statements)]
+        head_runs = runs[(head, input_format, and_ratio, statements)]
+        for stage in list(head_runs[-1]["stages"]) + ["total"]:
+            if stage != "total" and stage not in base_runs[-1]["stages"]:
+                continue
+            before, after = [
+                statistics.median(
+                    r["total"] if stage == "total" else r["stages"][stage]
+                    for r in stage_runs
+                )
+                for stage_runs in (base_runs, head_runs)
+            ]
+            change = (after - before) / before * 100 if before > 0 else 0.0
+            typer.echo(f"  {stage:48s} {before:8.3f}s {after:8.3f}s {change:+7.1f}%")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    app()
@@ -0,0 +1,205 @@
+import csv
+import itertools
+import math
+import os
+import random
+
+import typer
+
+import ig
+
+# Synthetic annotation sheets in the layout of the annotation template: a title
+# row, then the header with constitutive columns followed by regulative ones,
+# so the shared columns come a second time (read back with the ".1" suffix).
+header = [ig.CLASS, ig.STMT_FUNCTION, ig.STMT_NO, ig.STMT] + (
+    ig.constitutive_columns + ig.regulative_columns
+)
+regulative_offset = 4 + len(ig.constitutive_columns)
+# share of the activation condition references written as AND[...]
+default_and_ratio = 0.1
+
+nouns = (
+    "employee, employer, worker, contractor, health care provider, secretary, "
+    "agency, court, individual, family member, parent, child, spouse, "
+    "physician, nurse, clinic, hospital, insurer, union, inspector, officer, "
+    "board, commission, department, applicant, claimant, beneficiary, "
+    "landlord, tenant, school, student, teacher, vendor, supplier, customer, "
+    "carrier, operator, owner, manager, director"
+).split(", ")
+qualifiers = (
+    "certain, eligible, covered, qualified, public, private, small, large, "
+    "full time, part time, former, new, local, federal, licensed, registered, "
+    "temporary, permanent, senior, junior"
+).split(", ")
+properties = (
+    "of the employee, related to covid-19, under this act, in writing, "
+    "for the period, of the employer, as defined, in good faith, on request, "
+    "at least once"
+).split(", ")
+objects = (
+    "leave, paid sick time, medical diagnosis, self-quarantine, notice, pay, "
+    "wage, benefit, certification, record, report, schedule, request, claim, "
+    "policy, plan, complaint, hearing, document, premium"
+).split(", ")
+aims = (
+    "provide, advise, pay, care, exclude, seek, notify, grant, approve, deny, "
+    "review, submit, certify, verify, record, maintain, inform, request, "
+    "issue, file, post, retain, restore, reinstate, calculate, withhold, "
+    "deduct, reimburse, allow, permit, require, prohibit, investigate, "
+    "enforce, assess, collect, publish, disclose, report, deliver, designate, "
+    "appoint, register, renew, revoke, suspend, terminate, extend, establish, "
+    "determine"
+).split(", ")
+functions = ["means", "includes", "is", "refers to", "covers", "excludes"]
+deontics = ["must", "may", "shall", "must not", "may not"]
+
+
+def zipf_chooser(rng, vocabulary, size):
+    # the first words are used far more often, as in real documents
+    vocabulary = vocabulary[: max(1, size)]
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary)))
+    )
+    return lambda: rng.choices(vocabulary, cum_weights=cum_weights)[0]
+
+
+def vocabulary_sizes(statements):
+    # distinct entities and aims grow slower than the document
+    scale = math.sqrt(statements)
+    return {
+        "nouns": min(len(nouns), int(4 + scale / 2)),
+        "qualifiers": min(len(qualifiers), int(2 + scale / 8)),
+        "objects": min(len(objects), int(4 + scale / 4)),
+        "aims": min(len(aims), int(6 + scale / 2)),
+    }
+
+
+def statement_no(i):
+    return f"{i // 10 + 1}.{i % 10 + 1}"
+
+
+def generate_rows(
+    statements,
+    seed=0,
+    reference_ratio=0.3,
+    and_ratio=default_and_ratio,
+    illegal_ratio=0.01,
+):
+    rng = random.Random(seed)
+    sizes = vocabulary_sizes(statements)
+    noun = zipf_chooser(rng, nouns, sizes["nouns"])
+    qualifier = zipf_chooser(rng, qualifiers, sizes["qualifiers"])
+    obj = zipf_chooser(rng, objects, sizes["objects"])
+    aim = zipf_chooser(rng, aims, sizes["aims"])
+
+    def entity():
+        name = noun()
+        if rng.random() < 0.3:
+            name = f"{qualifier()} {name}"
+        return name
+
+    def prop():
+        return rng.choice(properties) if rng.random() < 0.4 else ""
+
+    # statements that can be referenced by activation conditions
+    referable = []
+    for i in range(statements):
+        row = dict.fromkeys(header, "")
+        row[ig.STMT_NO] = statement_no(i)
+        kind = rng.choices(
+            ["regulative", "regulative observation", "constitutive", "observation"],
+            weights=[5, 2, 2, 1],
+        )[0]
+        reference = ""
+        if len(referable) > 0 and rng.random() < reference_ratio:
+            r = rng.random()
+            window = referable[-200:]
+            if r < and_ratio:
+                reference = f"AND[{','.join(rng.sample(window, min(2, len(window))))}]"
+            elif r < 0.5:
+                reference = rng.choice(window)
+            elif r < 0.8:
+                reference = f"OR[{','.join(rng.sample(window, min(2, len(window))))}]"
+            else:
+                reference = f"[{rng.choice(window)}]"
+
+        if kind.startswith("regulative"):
+            observation = kind == "regulative observation"
+            row[ig.CLASS] = "regulative"
+            row[ig.STMT_FUNCTION] = "observation" if observation else "regulative"
+            row[ig.ATTR] = entity()
+            row[ig.ATTR_PROP] = prop()
+            row[ig.DEON] = "" if observation else rng.choice(deontics)
+            row[ig.AIM] = aim()
+            row[ig.DIR_OBJ] = obj()
+            row[ig.DIR_OBJ_PROP] = prop()
+            if rng.random() < 0.4:
+                row[ig.INDIR_OBJ] = entity()
+                row[ig.INDIR_OBJ_PROP] = prop()
+            if rng.random() < illegal_ratio:
+                row[ig.ATTR] = f"AND[{row[ig.STMT_NO]}] {row[ig.ATTR]}"
+            row[ig.STMT] = " ".join(
+                [row[ig.ATTR], row[ig.DEON], row[ig.AIM], row[ig.DIR_OBJ]]
+            )
+        else:
+            row[ig.CLASS] = "constitutive"
+            row[ig.STMT_FUNCTION] = kind
+            row[ig.ENT] = entity()
+            row[ig.ENT_PROP] = prop() if kind == "constitutive" else ""
+            row[ig.MODAL] = "may" if rng.random() < 0.2 else ""
+            row[ig.FUN] = rng.choice(functions)
+            row[ig.CON_PROP] = obj()
+            row[ig.CON_PROP_PROP] = prop()
+            row[ig.STMT] = " ".join([row[ig.ENT], row[ig.FUN], row[ig.CON_PROP]])
+
+        values = [row[column] for column in header]
+        if kind in ("constitutive", "regulative"):
+            # observations cannot have activation conditions
+            if kind == "regulative":
+                position = regulative_offset + ig.regulative_columns.index(
+                    ig.ACT_COND_REF
+                )
+            else:
+                position = header.index(ig.ACT_COND_REF)
+            values[position] = reference
+        yield values
+        referable.append(row[ig.STMT_NO])
+
+
+def write_sheet(rows, output_path):
+    title = ["Synthetic IG annotations"]
+    if os.path.splitext(output_path)[1] == ".xlsx":
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(title)
+        sheet.append(header)
+        for values in rows:
+            sheet.append([value if value != "" else None for value in values])
+        workbook.save(output_path)
+    else:
+        delimiter = "\t" if output_path.endswith(".tsv") else ","
+        with open(output_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            writer.writerow(title)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+def main(
+    statements: int,
+    output_path: str,
+    seed: int = 0,
+    reference_ratio: float = 0.3,
+    and_ratio: float = default_and_ratio,
+    illegal_ratio: float = 0.01,
+):
+    write_sheet(
+        generate_rows(statements, seed, reference_ratio, and_ratio, illegal_ratio),
+        output_path,
+    )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+import owlready2
+
+import ig
+from inflection import InflectionTable
+from metrics import BuildMetrics
+from rules import AncestorClosure, RuleBatch, RuleStages
+from serialization import save_ontology
+from statements import FrameStatements, RecordStatements
+
+logger = logging.getLogger(__name__)
+
+
+class OntologyBuilder(ig.OntologyStages, RuleStages):
+    # One build session: owns its owlready2 World, so several builders can
+    # live in one process (and in different threads) without sharing state.
+    def __init__(
+        self,
+        filename=":memory:",
+        base_iri="ig.onto.owl",
+        inflection_cache=None,
+        metrics=None,
+    ):
+        self.world = owlready2.World(filename=filename)
+        self.onto = self.world.get_ontology(base_iri)
+        # canonical class name -> class created by create_base_class/create_class
+        self.class_index = {}
+        self.relation_registry = ig.RelationRegistry()
+        # per statement bookkeeping refers to statements, classes and names by
+        # interned ids
+        stmts, classes, names = ig.Interner(), ig.Interner(), ig.Interner()
+        # (subject, relation name, object) rows of each statement
+        self.statement_no_to_realtion = ig.StatementTable(
+            stmts, classes, names, classes
+        )
+        # relation -> statement numbers it comes from, written out by flush_provenance
+        self.relation_provenance = defaultdict(list)
+        # (class type, class) rows, one per class type
+        self.statement_no_to_constituted_subclass = ig.StatementTable(
+            stmts, names, classes
+        )
+        # (class, parent) rows added by each statement, parent is None for reused classes
+        self.statement_no_to_classes = ig.StatementTable(stmts, classes, classes)
+        self.rule_batch = RuleBatch()
+        # class -> ancestors, for the variable unification of get_rule
+        self.ancestors = AncestorClosure()
+        self.inflections = InflectionTable(inflection_cache)
+        self.metrics = BuildMetrics() if metrics is None else metrics
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # owlready2 keeps recently used entities in a module level cache,
+        # which would otherwise keep the closed world alive
+        for onto in list(self.world.ontologies.values()):
+            onto._destroy_cached_entities()
+        self.world.close()
+        self.inflections.save()
+        self.__dict__.clear()
+
+    def save(
+        self,
+        output_ontology_path,
+        structured_provenance=False,
+        output_format=None,
+        sort=False,
+        base=None,
+    ):
+        # output_format: rdfxml, ntriples or turtle, by default from the
+        # extension (.nt, .ttl, optionally followed by .gz)
+        with self.metrics.stage("save"):
+            self.flush_provenance(structured=structured_provenance)
+            save_ontology(self.onto, output_ontology_path, output_format, sort, base)
+
+    def save_provenance_index(self, path):
+        # statement number -> classes, relations and rules, see provenance.py
+        from provenance import write_index
+
+        with self.metrics.stage("provenance_index"):
+            rows = write_index(self, path)
+        logger.info(f"Provenance index with {rows} rows written to {path}")
+
+    def build(self, df, rules_df=None):
+        # rules_df selects the statements whose activation condition rules are
+        # (re)defined, all of df by default
+        self.build_entities(df)
+        self.build_rules(df if rules_df is None else rules_df)
+        with self.metrics.stage("flush_rules"):
+            self.flush_rules()
+
+    def build_entities(self, df):
+        self.build_statement_entities(FrameStatements(df))
+
+    def build_statement_entities(self, statements):
+        # statements: statements.FrameStatements or RecordStatements
+        stage = self.metrics.stage
+
+        def create_classes(kind, columns, **options):
+            self.create_classes(
+                statements.rows(kind, columns),
+                statements.column(kind, ig.STMT_NO),
+                statements.row_ids(kind),
+                **options,
+            )
+
+        # # Constitutive
+        # ## Constitutive -- observations
+        with stage("classes_constitutive_observations"):
+            create_classes(
+                "observations",
+                [ig.ENT, ig.CON_FUNC, ig.CON_PROP, ig.CON_PROP_PROP],
+                connector_word="that",
+            )
+        # ## Constitutive -- proper, statements with an entity
+        # ### Constitutive -- proper: entities
+        with stage("classes_constitutive_entities"):
+            create_classes("constitutive", [ig.ENT, ig.ENT_PROP], class_type=ig.ENT)
+        # ### Constitutive -- proper: Constituted Properties
+        with stage("classes_constitutive_properties"):
+            create_classes(
+                "constitutive", [ig.CON_PROP, ig.CON_PROP_PROP], class_type=ig.CON_PROP
+            )
+        # # Regulative statements
+        # ## Regulative -- observations
+        # ### Regulative -- observations: attr
+        with stage("classes_regulative_observations_attributes"):
+            create_classes(
+                "regulative_observations", [ig.ATTR, ig.ATTR_PROP], class_type=ig.ATTR
+            )
+        # ### Regulative -- observations: direct object
+        with stage("classes_regulative_observations_objects"):
+            create_classes(
+                "regulative_observations",
+                [ig.DIR_OBJ, ig.DIR_OBJ_PROP],
+                class_type=ig.DIR_OBJ,
+            )
+        # ### Regulative -- observations: indirect objects
+        with stage("classes_regulative_observations_indirect_objects"):
+            create_classes(
+                "regulative_observations",
+                [ig.INDIR_OBJ, ig.INDIR_OBJ_PROP],
+                class_type=ig.INDIR_OBJ,
+            )
+        # ## Regulative -- proper regulative
+        # ### Regulative -- observations: attr
+        with stage("classes_regulative_attributes"):
+            create_classes("regulative", [ig.ATTR, ig.ATTR_PROP], class_type=ig.ATTR)
+        # ### Regulative -- objects
+        with stage("classes_regulative_objects"):
+            create_classes(
+                "regulative", [ig.DIR_OBJ, ig.DIR_OBJ_PROP], class_type=ig.DIR_OBJ
+            )
+        # ### Regulative -- indirect objects
+        with stage("classes_regulative_indirect_objects"):
+            create_classes(
+                "regulative",
+                [ig.INDIR_OBJ, ig.INDIR_OBJ_PROP],
+                class_type=ig.INDIR_OBJ,
+            )
+        # # Relations extraction
+        with stage("inflections"):
+            self.inflections.prepare(
+                set(statements.column("regulative_observations", ig.AIM))
+                | set(statements.column("regulative", ig.AIM))
+            )
+        # ### Regulative -- observations:  possible (aim) relations
+        with stage("relations_regulative_observations"):
+            self.create_observation_relations(
+                statements.rows(
+                    "regulative_observations", ig.observation_relation_columns
+                )
+            )
+        # ### Regulative (aim) relations
+        with stage("relations_regulative"):
+            self.create_regulative_relations(
+                statements.rows("regulative", ig.regulative_relation_columns)
+            )
+        # ### Constitutive (modal, function) relations
+        with stage("relations_constitutive"):
+            self.create_constitutive_relations(
+                statements.rows("constitutive", ig.constitutive_relation_columns)
+            )
+
+    def build_rules(self, df):
+        statements = FrameStatements(df)
+        self.build_condition_rules(
+            *(
+                zip(
+                    statements.column(kind, ig.STMT_NO),
+                    statements.column(kind, ig.ACT_COND_REF),
+                )
+                for kind in ["regulative", "constitutive"]
+            )
+        )
+
+    def build_condition_rules(self, regulative, constitutive):
+        # (statement number, activation condition reference) pairs of the
+        # regulative and constitutive statements
+        regulative, constitutive = list(regulative), list(constitutive)
+        # Defining rules
+        # ## Activation conditions
+        with self.metrics.stage("rules_graph"):
+            # every class exists by now
+            self.ancestors = AncestorClosure(self.class_index.values())
+            graph, dangling = self.condition_graph(regulative, constitutive)
+        regulative_stmt_nos = {stmt_no for stmt_no, _ in regulative}
+        constitutive_stmt_nos = {
+            stmt_no for stmt_no, _ in constitutive
+        } - regulative_stmt_nos
+        with self.metrics.stage("rules_regulative"):
+            self.define_activation_condition_rules(graph, dangling, regulative_stmt_nos)
+        with self.metrics.stage("rules_constitutive"):
+            self.define_activation_condition_rules(
+                graph, dangling, constitutive_stmt_nos
+            )
+
+    def build_records(self, records):
+        # records: statements.RegulativeStatement and ConstitutiveStatement, in
+        # sheet order, from any iterable. Class parents and relation suffixes
+        # depend on the stage order, so the records are normalized and kept
+        # as tuples until they run out, then built as a table of the same
+        # statements would be.
+        self._build_records(RecordStatements(records))
+
+    async def build_records_async(self, records):
+        # as build_records, from an async iterator as well; the stages run in
+        # a worker thread while the event loop goes on
+        statements = RecordStatements()
+        async for record in _aiter(records):
+            statements.extend([record])
+        await asyncio.to_thread(self._build_records, statements)
+
+    def _build_records(self, statements):
+        self.metrics.count("statement_records", len(statements))
+        self.build_statement_entities(statements)
+        self.build_condition_rules(
+            *(
+                zip(
+                    statements.column(kind, ig.STMT_NO),
+                    statements.column(kind, ig.ACT_COND_REF),
+                )
+                for kind in ["regulative", "constitutive"]
+            )
+        )
+        with self.metrics.stage("flush_rules"):
+            self.flush_rules()
+
+
+async def _aiter(records):
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            yield record
+    else:
+        for record in records:
+            yield record
@@ -0,0 +1,354 @@
+import csv
+import functools
+import gc
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+from collections import defaultdict, namedtuple
+
+from rules import _canonical_rule, format_rule
+from serialization import _split_iri, detect_output_format, prefixes
+
+# Structural diff of two built ontologies, read as plain triples rather than
+# loaded into owlready2. Each ontology becomes an index of items: classes,
+# relations, their provenance and the rules, keyed by name (by canonical text
+# for rules) and hashed, so that two builds compare in linear time.
+
+rdf = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+rdfs = "http://www.w3.org/2000/01/rdf-schema#"
+owl = "http://www.w3.org/2002/07/owl#"
+swrl = "http://www.w3.org/2003/11/swrl#"
+namespace_prefixes = {iri: prefix for prefix, iri in prefixes.items()}
+
+change_columns = ["statement", "kind", "name", "change", "details"]
+Change = namedtuple("Change", change_columns)
+# datatype is None for plain literals, "@lang" for tagged ones
+Literal = namedtuple("Literal", ["value", "datatype"])
+
+provenance_regex = re.compile(r"From statement: (\S+)")
+_ntriples_regex = re.compile(r"(\S+) <([^>]*)> (.*) \.")
+_literal_regex = re.compile(r'"(.*)"(?:@([\w\-]+)|\^\^<([^>]*)>)?', re.DOTALL)
+_escape_regex = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+_escapes = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+def _unescape(match):
+    code = match.group(1) or match.group(2)
+    if code is not None:
+        return chr(int(code, 16))
+    return _escapes.get(match.group(3), match.group(3))
+
+
+def _term(term):
+    # IRI or blank node as a string, "_:" prefixed for blank nodes
+    if term.startswith("<"):
+        return term[1:-1]
+    return term
+
+
+def read_ntriples(f):
+    for line in f:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        match = _ntriples_regex.fullmatch(line)
+        if match is None:
+            raise ValueError(f"Invalid N-Triples line: {line}")
+        s, p, o = match.groups()
+        if o.startswith('"'):
+            literal = _literal_regex.fullmatch(o)
+            if literal is None:
+                raise ValueError(f"Invalid N-Triples literal: {o}")
+            value, language, datatype = literal.groups()
+            o = Literal(
+                _escape_regex.sub(_unescape, value),
+                f"@{language}" if language else datatype,
+            )
+        else:
+            o = _term(o)
+        yield _term(s), p, o
+
+
+def read_rdfxml(f):
+    from owlready2.rdfxml_2_ntriples import parse
+
+    triples = []
+    parse(
+        f,
+        lambda s, p, o: triples.append((s, p, o)),
+        lambda s, p, o, d: triples.append((s, p, Literal(o, d or None))),
+    )
+    return triples
+
+
+def read_triples(path, input_format=None):
+    # RDF/XML or N-Triples as written by build, optionally gzip compressed
+    if input_format is None:
+        input_format = detect_output_format(path)
+    opener = gzip.open if path.endswith(".gz") else open
+    if input_format == "ntriples":
+        with opener(path, "rt", encoding="utf-8") as f:
+            return list(read_ntriples(f))
+    if input_format == "rdfxml":
+        with opener(path, "rb") as f:
+            return read_rdfxml(f)
+    raise ValueError(f"Unsupported input format for diff: {input_format}")
+
+
+class OntologyIndex:
+    # (kind, name) -> digest of the description of the classes, relations,
+    # provenance and rules of an ontology. Entities are named by their IRI
+    # fragment, so that builds saved with different bases compare equal.
+    def __init__(self, triples):
+        self.subjects = defaultdict(lambda: defaultdict(list))
+        for s, p, o in triples:
+            self.subjects[s][p].append(o)
+        self.items = {}
+        # relation name -> statement numbers of its provenance
+        self.statements = {}
+        self.descriptions = {}
+        for s, properties in self.subjects.items():
+            types = properties.get(rdf + "type", [])
+            if owl + "Class" in types:
+                self.add("class", self.name(s), self.describe_entity(properties))
+            elif owl + "ObjectProperty" in types or owl + "DatatypeProperty" in types:
+                name = self.name(s)
+                statements = self.provenance(properties)
+                self.statements[name] = statements
+                self.add("relation", name, self.describe_entity(properties))
+                if len(statements) > 0:
+                    self.add("provenance", name, statements)
+            elif swrl + "Imp" in types:
+                rule = self.rule(properties)
+                self.add("rule", format_rule(*rule), rule[1])
+
+    def add(self, kind, name, description):
+        digest = hashlib.blake2b(repr(description).encode(), digest_size=16)
+        self.items[(kind, name)] = digest.digest()
+        self.descriptions[(kind, name)] = description
+
+    def name(self, iri):
+        return _name(iri)
+
+    def provenance(self, properties):
+        statements = []
+        for comment in properties.get(rdfs + "comment", []):
+            statements += provenance_regex.findall(str(comment.value))
+        return tuple(statements)
+
+    def describe_entity(self, properties):
+        # predicate -> sorted objects, provenance aside
+        description = {}
+        for p, objects in properties.items():
+            if p == rdfs + "comment":
+                objects = [
+                    o for o in objects if not provenance_regex.match(str(o.value))
+                ]
+            if p == rdf + "type" or len(objects) == 0:
+                continue
+            description[self.name(p)] = tuple(sorted(map(self.describe, objects)))
+        return description
+
+    def describe(self, term, seen=()):
+        # blank nodes by their content, lists as their items
+        if isinstance(term, Literal):
+            return f'"{term.value}"{term.datatype or ""}'
+        if not term.startswith("_:"):
+            return self.name(term)
+        if term in seen:
+            return "_:cycle"
+        seen = (*seen, term)
+        items = self.list_items(term)
+        if items is not None:
+            return f"({' '.join(self.describe(item, seen) for item in items)})"
+        properties = self.subjects.get(term, {})
+        content = sorted(
+            f"{self.name(p)} {self.describe(o, seen)}"
+            for p, objects in properties.items()
+            for o in objects
+        )
+        return f"[{'; '.join(content)}]"
+
+    def list_items(self, term):
+        items = []
+        while term != rdf + "nil":
+            properties = self.subjects.get(term, {})
+            first = properties.get(rdf + "first")
+            rest = properties.get(rdf + "rest")
+            if not first or not rest:
+                return None
+            items.append(first[0])
+            term = rest[0]
+        return items
+
+    def rule(self, properties):
+        # canonical (body, head) as RuleBatch keys rules: variables renamed in
+        # order of appearance
+        def atoms(atom_list):
+            parsed = []
+            for atom in self.list_items(atom_list) or []:
+                atom_properties = self.subjects.get(atom, {})
+                predicate = atom_properties.get(swrl + "classPredicate")
+                if predicate is None:
+                    predicate = atom_properties.get(swrl + "propertyPredicate", ["?"])
+                args = [
+                    (
+                        f"?{arg[len('urn:swrl#'):]}"
+                        if arg.startswith("urn:swrl#")
+                        else self.describe(arg)
+                    )
+                    for position in ["argument1", "argument2"]
+                    for arg in atom_properties.get(swrl + position, [])
+                ]
+                parsed.append((self.name(predicate[0]), tuple(args)))
+            return tuple(parsed)
+
+        return _canonical_rule(
+            atoms(properties.get(swrl + "body", [rdf + "nil"])[0]),
+            atoms(properties.get(swrl + "head", [rdf + "nil"])[0]),
+        )
+
+    def relations(self, kind, name):
+        # the relations whose provenance an item is attributed to
+        if kind in ("relation", "provenance"):
+            return [name]
+        if kind == "rule" and (kind, name) in self.descriptions:
+            # the relations the rule concludes in
+            return [predicate for predicate, _ in self.descriptions[(kind, name)]]
+        # classes have no provenance in the ontology
+        return []
+
+
+@functools.lru_cache(maxsize=65536)
+def _name(iri):
+    namespace, local_name = _split_iri(iri)
+    prefix = namespace_prefixes.get(namespace)
+    if prefix is not None:
+        return f"{prefix}:{local_name}"
+    # a build has a single namespace of its own
+    return local_name if "#" in iri else f"<{iri}>"
+
+
+def diff_indexes(old, new):
+    changes = []
+    for key in old.items.keys() | new.items.keys():
+        before, after = old.items.get(key), new.items.get(key)
+        if before == after:
+            continue
+        kind, name = key
+        change = (
+            "added" if before is None else "removed" if after is None else "changed"
+        )
+        details = _details(kind, old.descriptions.get(key), new.descriptions.get(key))
+        statements = set()
+        for relation in set(old.relations(*key) + new.relations(*key)):
+            statements |= _changed_statements(old, new, relation)
+        for statement in sorted(statements, key=statement_key) or [None]:
+            changes.append(Change(statement, kind, name, change, details))
+    return sorted(changes, key=lambda c: (statement_key(c.statement), c[1:4]))
+
+
+def _changed_statements(old, new, relation):
+    # the statements that joined or left the provenance of relation, all of
+    # them if it did not change
+    before = set(old.statements.get(relation, ()))
+    after = set(new.statements.get(relation, ()))
+    return (before ^ after) or (before | after)
+
+
+def _details(kind, before, after):
+    # what was added (+) and removed (-) within an item
+    if kind == "rule":
+        return ""
+    if kind == "provenance":
+        before, after = set(before or ()), set(after or ())
+        return "; ".join(
+            [f"+{s}" for s in sorted(after - before, key=statement_key)]
+            + [f"-{s}" for s in sorted(before - after, key=statement_key)]
+        )
+    before, after = before or {}, after or {}
+    details = []
+    for p in sorted(before.keys() | after.keys()):
+        old_objects, new_objects = set(before.get(p, ())), set(after.get(p, ()))
+        details += [f"+{p} {o}" for o in sorted(new_objects - old_objects)]
+        details += [f"-{p} {o}" for o in sorted(old_objects - new_objects)]
+    return "; ".join(details)
+
+
+def statement_key(statement):
+    # "1.10" after "1.2", changes without a statement last
+    if statement is None:
+        return (1, ())
+    return (
+        0,
+        tuple(
+            (0, int(p), "") if p.isdigit() else (1, 0, p) for p in statement.split(".")
+        ),
+    )
+
+
+def diff_files(old_path, new_path, input_format=None):
+    # the indexes only grow until the diff is done; collections while they
+    # are built cost about a third of the time
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return diff_indexes(
+            OntologyIndex(read_triples(old_path, input_format)),
+            OntologyIndex(read_triples(new_path, input_format)),
+        )
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def format_changes(changes):
+    symbols = {"added": "+", "removed": "-", "changed": "~"}
+    lines = []
+    for statement, group in itertools.groupby(changes, key=lambda c: c.statement):
+        lines.append("without statement" if statement is None else statement)
+        for c in group:
+            details = f" ({c.details})" if c.details else ""
+            lines.append(f"  {symbols[c.change]} {c.kind} {c.name}{details}")
+    return lines
+
+
+def summarize(changes):
+    counts = defaultdict(int)
+    for c in {(c.kind, c.name, c.change) for c in changes}:
+        counts[f"{c[0]} {c[2]}"] += 1
+    return dict(sorted(counts.items()))
+
+
+def write_report(changes, report_path, report_format=None, old=None, new=None):
+    if report_format is None:
+        report_format = os.path.splitext(report_path)[1].lstrip(".").lower()
+    if report_format == "csv":
+        with open(report_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(change_columns)
+            writer.writerows(changes)
+    elif report_format == "json":
+        statements = {}
+        for c in changes:
+            statements.setdefault(c.statement or "", []).append(
+                {
+                    "kind": c.kind,
+                    "name": c.name,
+                    "change": c.change,
+                    "details": c.details,
+                }
+            )
+        report = {
+            "old": old,
+            "new": new,
+            "counts": summarize(changes),
+            "statements": statements,
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        raise ValueError(f"Unsupported report format: {report_format}")
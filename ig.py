@@ -1,12 +1,10 @@
+import functools
 import logging
 import re
 import types
+from array import array
 from collections import defaultdict
 
-import lemminflect
-import owlready2
-
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -46,7 +44,190 @@ regulative_columns = [
     "Or else (Reference to consequential statement)",
     "Logical combination",
 ]
-original_relation_to_relation = defaultdict(dict)
+
+
+class RelationRegistry:
+    # Relation names sharing a base get a "'" per distinct subject: base, base', ...
+    def __init__(self):
+        self.defined = set()
+        # name -> number of consecutive defined names name, name', name'', ...
+        self.chain_length = defaultdict(int)
+        # (name, subject) -> lowest number of "'" whose relation has subject in domain
+        self.first_suffix = {}
+
+    def __contains__(self, relation_name):
+        return relation_name in self.defined
+
+    def resolve(self, relation_name, subject):
+        suffix = self.chain_length[relation_name]
+        suffix = min(suffix, self.first_suffix.get((relation_name, subject), suffix))
+        return relation_name + "'" * suffix
+
+    def get(self, relation_name, subject):
+        suffix = self.first_suffix.get((relation_name, subject))
+        return relation_name if suffix is None else relation_name + "'" * suffix
+
+    def register(self, relation_name, subject):
+        self.defined.add(relation_name)
+        base = relation_name.rstrip("'")
+        for suffix in range(len(relation_name) - len(base) + 1):
+            name = relation_name[: len(relation_name) - suffix]
+            key = (name, subject)
+            if suffix < self.first_suffix.get(key, suffix + 1):
+                self.first_suffix[key] = suffix
+            while name + "'" * self.chain_length[name] in self.defined:
+                self.chain_length[name] += 1
+
+
+class Interner:
+    # value <-> small int, in order of first use; None is always 0
+    __slots__ = ("ids", "values")
+
+    def __init__(self):
+        self.ids = {None: 0}
+        self.values = [None]
+
+    def id(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return id
+
+
+class StatementTable:
+    # Rows of interned values per statement number, interned as well. The ids
+    # of all rows are kept in one flat array, with the row before each one of
+    # the same statement, so a row costs 4 bytes per field whatever it refers
+    # to. Rows are returned as tuples in the order they were appended,
+    # statements in the order they got their first row.
+    __slots__ = (
+        "statements",
+        "interners",
+        "fields",
+        "previous",
+        "last",
+        "order",
+        "position",
+    )
+
+    def __init__(self, statements, *interners):
+        # interners of the statement numbers and of each field
+        self.statements = statements
+        self.interners = interners
+        self.clear()
+
+    def clear(self):
+        self.fields = array("i")
+        self.previous = array("i")
+        # statement id -> its last row, -1 without rows
+        self.last = array("i")
+        # statement ids by first row and their index in there; entries of
+        # removed statements are left behind
+        self.order = array("i")
+        self.position = array("i")
+
+    def _id(self, stmt_no):
+        # None when stmt_no has no rows
+        id = self.statements.ids.get(stmt_no)
+        if id is None or id >= len(self.last) or self.last[id] == -1:
+            return None
+        return id
+
+    def append(self, stmt_no, *values):
+        id = self.statements.id(stmt_no)
+        missing = id + 1 - len(self.last)
+        if missing > 0:
+            self.last.extend([-1] * missing)
+            self.position.extend([-1] * missing)
+        if self.last[id] == -1:
+            self.position[id] = len(self.order)
+            self.order.append(id)
+        self.fields.extend(
+            [interner.id(value) for interner, value in zip(self.interners, values)]
+        )
+        self.previous.append(self.last[id])
+        self.last[id] = len(self.previous) - 1
+
+    def set(self, stmt_no, key, *values):
+        # replaces the row of stmt_no whose first field is key, if any
+        width = len(self.interners)
+        key_id = self.interners[0].ids.get(key)
+        for row in self._rows(stmt_no):
+            if self.fields[row * width] == key_id:
+                self.fields[row * width + 1 : (row + 1) * width] = array(
+                    "i",
+                    [
+                        interner.id(value)
+                        for interner, value in zip(self.interners[1:], values)
+                    ],
+                )
+                return
+        self.append(stmt_no, key, *values)
+
+    def lookup(self, stmt_no, key):
+        # second field of the row of stmt_no whose first field is key
+        for row in reversed(self.get(stmt_no)):
+            if row[0] == key:
+                return row[1]
+        raise KeyError((stmt_no, key))
+
+    def _rows(self, stmt_no):
+        id = self._id(stmt_no)
+        row = -1 if id is None else self.last[id]
+        while row != -1:
+            yield row
+            row = self.previous[row]
+
+    def _row(self, row):
+        width = len(self.interners)
+        return tuple(
+            interner.values[id]
+            for interner, id in zip(
+                self.interners, self.fields[row * width : (row + 1) * width]
+            )
+        )
+
+    def get(self, stmt_no, default=()):
+        rows = [self._row(row) for row in self._rows(stmt_no)]
+        if len(rows) == 0:
+            return default
+        rows.reverse()
+        return rows
+
+    def latest(self, stmt_no):
+        id = self._id(stmt_no)
+        if id is None:
+            raise KeyError(stmt_no)
+        return self._row(self.last[id])
+
+    def pop(self, stmt_no, default=()):
+        # the rows stay in the arrays, unreachable
+        rows = self.get(stmt_no, default)
+        id = self._id(stmt_no)
+        if id is not None:
+            self.last[id] = -1
+            self.position[id] = -1
+        return rows
+
+    def __contains__(self, stmt_no):
+        return self._id(stmt_no) is not None
+
+    def __iter__(self):
+        for index, id in enumerate(self.order):
+            if self.position[id] == index:
+                yield self.statements.values[id]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        for stmt_no in list(self):
+            yield stmt_no, self.get(stmt_no)
+
+    def values(self):
+        for _, rows in self.items():
+            yield rows
 
 
 def check_observations_constraints(df_observations):
@@ -55,21 +236,14 @@ def check_observations_constraints(df_observations):
         logger.warning(
             f"There are observations with non-empty activation condition {problematic_stmts}"
         )
+    return problematic_stmts
 
 
 def check_duplicates(df):
     a = df[df[STMT_NO].duplicated()][STMT_NO]
     if len(a) > 0:
         logger.warning(f"Duplicated statement numbers: {list(a)}")
-
-
-def get_relation_name(semantic_relation_name, subject):
-    a = original_relation_to_relation.get(semantic_relation_name)
-    if a is not None:
-        b = a.get(subject)
-        if b is not None:
-            return b
-    return semantic_relation_name
+    return list(a)
 
 
 both = ["Statement function", "Statement No.", "Statement"]
@@ -99,120 +273,80 @@ FUN = "Function"
 MODAL = "Modal"
 
 ACT_COND = "Activation Condition (Content)"
+EXEC_CONSTR = "Execution Constraint (Content)"
 
 ENT_PROP_REF = "Constituted Entity Property (Reference to statement)"
 CON_PROP_REF = "Constituted Properties (Reference to statement)"
 CON_PROP_PROP_REF = "Constituted Properties Property (Reference to statement)"
 ACT_COND_REF = "Activation Condition (Reference to statement)"
+EXEC_CONSTR_REF = "Execution Constraint (Reference to statement)"
 
 ATTR_PROP_REF = "Attributes property (Reference to statement)"
 DIR_OBJ_REF = "Direct Object (Reference to statement)"
 
 STMT = "Statement"
 STMT_NO = "Statement No."
-onto = owlready2.get_ontology("ig.onto.owl")
+
+# columns of the rows the relation stages read
+regulative_relation_columns = [
+    ATTR,
+    ATTR_PROP,
+    DEON,
+    AIM,
+    DIR_OBJ,
+    DIR_OBJ_PROP,
+    INDIR_OBJ,
+    INDIR_OBJ_PROP,
+    STMT_NO,
+]
+observation_relation_columns = [
+    ATTR,
+    ATTR_PROP,
+    AIM,
+    DIR_OBJ,
+    DIR_OBJ_PROP,
+    INDIR_OBJ,
+    INDIR_OBJ_PROP,
+    STMT_NO,
+]
+constitutive_relation_columns = [
+    ENT,
+    ENT_PROP,
+    CON_PROP,
+    CON_PROP_PROP,
+    STMT_NO,
+    MODAL,
+    FUN,
+]
 
 
-def get_class(name):
-    return onto[fix_class_name(name)]
+_dash_to_space = str.maketrans("-", " ")
+_drop_brackets = str.maketrans("", "", "|[]")
+_drop_spaces = str.maketrans("", "", " ")
 
 
+@functools.lru_cache(maxsize=65536)
 def fix_class_name(name):
     # TODO: fix
-    name = name.lower()
-    name = name.replace("-", " ")
-    name = name.replace("and[each,", "")
-    name = name.replace("and[any", "")
-    name = name.replace("|", "")
-    name = name.replace("[", "").replace("]", "")
-    name = name.replace("the", "")
-    return name.title().replace(" ", "")
+    name = name.lower().translate(_dash_to_space)
+    name = name.replace("and[each,", "").replace("and[any", "")
+    name = name.translate(_drop_brackets).replace("the", "")
+    return name.title().translate(_drop_spaces)
 
 
 def fix_relation_name(name: str) -> str:
     return name.replace(" ", "_")
 
 
-def create_base_class(name):
-    name = fix_class_name(name)
-    if name == "":
-        return None
-    with onto:
-        new_class = types.new_class(name, (owlready2.Thing,))
-    return new_class
-
-
-def create_class(name, superclass):
-    if superclass is None:
-        raise TypeError(f"superclass of ({name}) is missing")
-    name = fix_class_name(name)
-    if name == "":
-        return None
-    new_class = types.new_class(name, (superclass,))
-
-    return new_class
-
-
-statement_no_to_realtion = defaultdict(list)
-statement_no_to_constituted_subclass = defaultdict(dict)
-
-
-def define_relationship(
-    subject,
-    relation_name,
-    object,
-    statement_no,
-    relation_constraint="",
-    unique_relation=True,
-):
-    comments = []
-    relation_name = fix_relation_name(relation_name)
-    original_relation = relation_name
-    if unique_relation:
-        while onto[relation_name] is not None:
-            if subject in onto[relation_name].domain:
-                # if there is relation with same subject, update it subject
-                logger.debug(f"Relation {relation_name} exsits. Updating...")
-                comments = onto[relation_name].comment
-                break
-            relation_name += "'"
-            logger.debug(f"Relation {relation_name} already exsits, appending '")
-        original_relation_to_relation[original_relation][subject] = relation_name
-
-    else:
-        relation = onto[relation_name]
-        if relation is not None:
-            logger.debug(f"Relation {relation} exsits. Updating...")
-            comments = relation.comment
-
-    logger.debug(f"Defining relation {subject} - {relation_name} - {object}")
-
-    with onto:
-        relation = types.new_class(relation_name, (subject >> object,))
-        if relation_constraint == "some":
-            relation.class_property_type = ["some"]
-        # relation.comment = []
-        if statement_no is not None:
-            relation.comment = comments
-            relation.comment.append(f"From statement: {statement_no}")
-            relation.comment = ["\n".join(relation.comment)]
-
-    statement_no_to_realtion[statement_no].append((subject, relation_name, object))
-
-
-def get_passive(verb):
-    return lemminflect.getInflection(verb, tag="VBD")[0]
+def get_passive_deontic_relation_name(deontic, passive):
+    return " ".join([deontic, "be", passive, "to"])
 
 
-def get_passive_deontic_relation_name(deontic, aim):
-    return " ".join([deontic, "be", get_passive(aim), "to"])
+def get_passive_relation_name(passive):
+    return " ".join(["is", passive])
 
 
-def get_passive_relation_name(aim):
-    return " ".join(["is", get_passive(aim)])
-
-
-illegal_regex = r"AND\[[\d\.,]+\]"
+illegal_regex = re.compile(r"AND\[[\d\.,]+\]")
 
 
 def report_annotation_error(row_num, error):
@@ -225,122 +359,230 @@ def report_missing(subj, obj, stmt_no):
     )
 
 
-def create_classes_from_df(
-    subclasses_df, statement_nos, connector_word=None, class_type="default"
-):
-    created_classes = []
-    for (id, row), stmt_no in zip(subclasses_df.iterrows(), statement_nos):
-        try:
-            superclass_name = row[0]
-            if re.search(illegal_regex, superclass_name):
-                report_annotation_error(id, superclass_name)
-            superclass = get_class(superclass_name)
-            if superclass is None:
-                superclass = create_base_class(superclass_name)
-            if connector_word is not None:
-                subclass_name = " ".join([row[0], connector_word, *row[1:]])
-            else:
-                subclass_name = " ".join(row)
-            if re.search(illegal_regex, " ".join(row[1:])):
-                report_annotation_error(stmt_no, " ".join(row[1:]))
-            if row[1] != "":  # do not create empty
-                subclass = create_class(subclass_name, superclass)
-                statement_no_to_constituted_subclass[stmt_no][class_type] = subclass
-            else:
-                statement_no_to_constituted_subclass[stmt_no][class_type] = superclass
-                subclass = None
-
-            created_classes.append((superclass, subclass))
-        except TypeError as e:
-            logger.warning(e)
-    return set(created_classes)
-
-
-def create_relations_from_regulative_aim(
-    df_subject, df_relation, df_object, df_indir_object, stmt_nos
-):
-    forward_relations = 0
-    passive_relations = 0
-    for (_, subj_row), (_, rel_row), (_, obj_row), (_, iobj_row), stmt_no in zip(
-        df_subject.iterrows(),
-        df_relation.iterrows(),
-        df_object.iterrows(),
-        df_indir_object.iterrows(),
-        stmt_nos,
+class OntologyStages:
+    # Class and relation stages of OntologyBuilder. Work on self.onto and the
+    # indexes created by OntologyBuilder.__init__.
+
+    def get_class(self, name):
+        return self.class_index.get(fix_class_name(name))
+
+    def create_base_class(self, name):
+        import owlready2
+
+        name = fix_class_name(name)
+        if name == "":
+            return None
+        with self.onto:
+            new_class = types.new_class(name, (owlready2.Thing,))
+        self.class_index[name] = new_class
+        return new_class
+
+    def create_class(self, name, superclass):
+        if superclass is None:
+            raise TypeError(f"superclass of ({name}) is missing")
+        name = fix_class_name(name)
+        if name == "":
+            return None
+        new_class = types.new_class(name, (superclass,))
+        self.class_index[name] = new_class
+        return new_class
+
+    def define_relationship(
+        self,
+        subject,
+        relation_name,
+        object,
+        statement_no,
+        relation_constraint="",
+        unique_relation=True,
     ):
-        subj = get_class(" ".join(subj_row))
-        obj = get_class(" ".join(obj_row))
-        relation_name = fix_relation_name(" ".join(rel_row))
-        deontic = rel_row[DEON]
-        aim = rel_row[AIM]
-        if not (subj is None or obj is None):
-            define_relationship(subj, relation_name, obj, statement_no=stmt_no)
-            forward_relations += 1
-            indir_obj = get_class(" ".join(iobj_row))
-            if not (indir_obj is None or obj is None):
-                passive_relations += 1
-                passive_relation = get_passive_deontic_relation_name(deontic, aim)
-                define_relationship(
-                    obj, passive_relation, indir_obj, statement_no=stmt_no
+        relation_name = fix_relation_name(relation_name)
+        if unique_relation:
+            original_relation = relation_name
+            relation_name = self.relation_registry.resolve(relation_name, subject)
+            if relation_name != original_relation:
+                self.metrics.count("relation_suffix_collisions")
+                logger.debug(
+                    f"Relation {original_relation} already exsits, using {relation_name}"
                 )
+        if relation_name in self.relation_registry:
+            logger.debug(f"Relation {relation_name} exsits. Updating...")
+            self.metrics.count("relations_defined", kind="updated")
         else:
-            report_missing(subj, obj, stmt_no)
-    logger.info("Forward relations defined: " + str(forward_relations))
-    logger.info("Passive relations defined: " + str(passive_relations))
-
-
-def create_relations_from_obserations_aim_from_df(df):
-    forward_relations = 0
-    passive_relations = 0
-    for _, row in df.iterrows():
-        attr = row[ATTR]
-        attrs_prop = row[ATTR_PROP]
-        aim = row[AIM]
-        dir_obj = row[DIR_OBJ]
-        dir_obj_prop = row[DIR_OBJ_PROP]
-        indir_obj = row[INDIR_OBJ]
-        indir_obj_prop = row[INDIR_OBJ_PROP]
-        stmt_no = row[STMT_NO]
-
-        subj = get_class(" ".join([attr, attrs_prop]))
-        obj = get_class(" ".join([dir_obj, dir_obj_prop]))
-        relation_name = fix_relation_name(aim)
-        if not (subj is None or obj is None):
-            define_relationship(
-                subj, relation_name, obj, statement_no=stmt_no, unique_relation=False
-            )
-            forward_relations += 1
-            indirect_object = get_class(" ".join([indir_obj, indir_obj_prop]))
-            if indirect_object is not None:
-                passive_relations += 1
-                passive_relation = get_passive_relation_name(aim)
-                define_relationship(
+            self.metrics.count("relations_defined", kind="new")
+
+        logger.debug(f"Defining relation {subject} - {relation_name} - {object}")
+
+        with self.onto:
+            relation = types.new_class(relation_name, (subject >> object,))
+            if relation_constraint == "some":
+                relation.class_property_type = ["some"]
+        if statement_no is not None:
+            self.relation_provenance[relation].append(statement_no)
+
+        self.relation_registry.register(relation_name, subject)
+        self.statement_no_to_realtion.append(
+            statement_no, subject, relation_name, object
+        )
+
+    def flush_provenance(self, structured=False):
+        with self.onto:
+            for relation, statement_nos in self.relation_provenance.items():
+                comments = [f"From statement: {stmt_no}" for stmt_no in statement_nos]
+                relation.comment = comments if structured else ["\n".join(comments)]
+        self.relation_provenance.clear()
+
+    def create_classes(
+        self, rows, statement_nos, row_ids, connector_word=None, class_type="default"
+    ):
+        # rows: (class, *properties) string tuples, row_ids name the rows in
+        # annotation error messages
+        import owlready2
+
+        known_classes = len(self.class_index)
+        for id, row, stmt_no in zip(row_ids, rows, statement_nos):
+            try:
+                superclass_name = row[0]
+                if illegal_regex.search(superclass_name):
+                    report_annotation_error(id, superclass_name)
+                superclass = self.get_class(superclass_name)
+                if superclass is None:
+                    superclass = self.create_base_class(superclass_name)
+                    parent = owlready2.Thing
+                else:
+                    parent = None
+                if superclass is not None:
+                    self.statement_no_to_classes.append(stmt_no, superclass, parent)
+                if connector_word is not None:
+                    subclass_name = " ".join([row[0], connector_word, *row[1:]])
+                else:
+                    subclass_name = " ".join(row)
+                if illegal_regex.search(" ".join(row[1:])):
+                    report_annotation_error(stmt_no, " ".join(row[1:]))
+                if row[1] != "":  # do not create empty
+                    subclass = self.create_class(subclass_name, superclass)
+                    if subclass is not None:
+                        self.statement_no_to_classes.append(
+                            stmt_no, subclass, superclass
+                        )
+                    self.statement_no_to_constituted_subclass.set(
+                        stmt_no, class_type, subclass
+                    )
+                else:
+                    self.statement_no_to_constituted_subclass.set(
+                        stmt_no, class_type, superclass
+                    )
+            except TypeError as e:
+                logger.warning(e)
+        self.metrics.count(
+            "classes_created",
+            len(self.class_index) - known_classes,
+            class_type=class_type,
+        )
+
+    def create_regulative_relations(self, rows):
+        # rows: values of regulative_relation_columns
+        forward_relations = 0
+        passive_relations = 0
+        for (
+            attr,
+            attr_prop,
+            deontic,
+            aim,
+            dir_obj,
+            dir_obj_prop,
+            indir_obj_name,
+            indir_obj_prop,
+            stmt_no,
+        ) in rows:
+            subj = self.get_class(" ".join([attr, attr_prop]))
+            obj = self.get_class(" ".join([dir_obj, dir_obj_prop]))
+            relation_name = fix_relation_name(" ".join([deontic, aim]))
+            if not (subj is None or obj is None):
+                self.define_relationship(subj, relation_name, obj, statement_no=stmt_no)
+                forward_relations += 1
+                indir_obj = self.get_class(" ".join([indir_obj_name, indir_obj_prop]))
+                if not (indir_obj is None or obj is None):
+                    passive_relations += 1
+                    passive_relation = get_passive_deontic_relation_name(
+                        deontic, self.inflections.past(aim)
+                    )
+                    self.define_relationship(
+                        obj, passive_relation, indir_obj, statement_no=stmt_no
+                    )
+            else:
+                report_missing(subj, obj, stmt_no)
+        logger.info("Forward relations defined: " + str(forward_relations))
+        logger.info("Passive relations defined: " + str(passive_relations))
+        self.metrics.count("relations_forward", forward_relations, source="regulative")
+        self.metrics.count("relations_passive", passive_relations, source="regulative")
+
+    def create_observation_relations(self, rows):
+        # rows: values of observation_relation_columns
+        forward_relations = 0
+        passive_relations = 0
+        for (
+            attr,
+            attrs_prop,
+            aim,
+            dir_obj,
+            dir_obj_prop,
+            indir_obj,
+            indir_obj_prop,
+            stmt_no,
+        ) in rows:
+            subj = self.get_class(" ".join([attr, attrs_prop]))
+            obj = self.get_class(" ".join([dir_obj, dir_obj_prop]))
+            relation_name = fix_relation_name(aim)
+            if not (subj is None or obj is None):
+                self.define_relationship(
+                    subj,
+                    relation_name,
                     obj,
-                    passive_relation,
-                    indirect_object,
                     statement_no=stmt_no,
                     unique_relation=False,
                 )
-        else:
-            report_missing(subj, obj, stmt_no)
-
-
-def create_constitutive_modal_function_relations_from_df(df):
-    for _, row in df.iterrows():
-        subj = get_class(" ".join(row[[ENT, ENT_PROP]]))
-        obj = get_class(" ".join(row[[CON_PROP, CON_PROP_PROP]]))
-        statement_no = row[STMT_NO]
-        modal = row[MODAL]
-        function = row[FUN]
-        relation_name = " ".join([modal, function]) if modal != "" else function
-        relation_name = fix_relation_name(relation_name)
-        if not (subj is None or obj is None):
-            define_relationship(
-                subj,
-                relation_name,
-                obj,
-                statement_no=statement_no,
-                unique_relation=True,
-            )
-        else:
-            report_missing(subj, obj, statement_no)
+                forward_relations += 1
+                indirect_object = self.get_class(" ".join([indir_obj, indir_obj_prop]))
+                if indirect_object is not None:
+                    passive_relations += 1
+                    passive_relation = get_passive_relation_name(
+                        self.inflections.past(aim)
+                    )
+                    self.define_relationship(
+                        obj,
+                        passive_relation,
+                        indirect_object,
+                        statement_no=stmt_no,
+                        unique_relation=False,
+                    )
+            else:
+                report_missing(subj, obj, stmt_no)
+        self.metrics.count("relations_forward", forward_relations, source="observation")
+        self.metrics.count("relations_passive", passive_relations, source="observation")
+
+    def create_constitutive_relations(self, rows):
+        # rows: values of constitutive_relation_columns
+        for (
+            ent,
+            ent_prop,
+            con_prop,
+            con_prop_prop,
+            statement_no,
+            modal,
+            function,
+        ) in rows:
+            subj = self.get_class(" ".join([ent, ent_prop]))
+            obj = self.get_class(" ".join([con_prop, con_prop_prop]))
+            relation_name = " ".join([modal, function]) if modal != "" else function
+            relation_name = fix_relation_name(relation_name)
+            if not (subj is None or obj is None):
+                self.define_relationship(
+                    subj,
+                    relation_name,
+                    obj,
+                    statement_no=statement_no,
+                    unique_relation=True,
+                )
+            else:
+                report_missing(subj, obj, statement_no)
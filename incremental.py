@@ -0,0 +1,241 @@
+import logging
+from collections import defaultdict
+
+import owlready2
+import pandas as pd
+
+import ig
+import rules
+
+logger = logging.getLogger(__name__)
+
+THING = "owl:Thing"
+
+schema = """
+CREATE TABLE IF NOT EXISTS ig_statements (stmt_no TEXT PRIMARY KEY, fingerprint TEXT);
+CREATE TABLE IF NOT EXISTS ig_classes (stmt_no TEXT, class TEXT, parent TEXT);
+CREATE TABLE IF NOT EXISTS ig_constituted (stmt_no TEXT, class_type TEXT, class TEXT);
+CREATE TABLE IF NOT EXISTS ig_relations (stmt_no TEXT, subject TEXT, relation TEXT, object TEXT);
+CREATE TABLE IF NOT EXISTS ig_rules (rule TEXT, storid INTEGER, activation TEXT, conclusion TEXT);
+CREATE INDEX IF NOT EXISTS ig_classes_stmt ON ig_classes (stmt_no);
+CREATE INDEX IF NOT EXISTS ig_constituted_stmt ON ig_constituted (stmt_no);
+CREATE INDEX IF NOT EXISTS ig_relations_stmt ON ig_relations (stmt_no);
+"""
+
+
+def fingerprint_statements(df):
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    fingerprints = {}
+    for stmt_no, h in zip(df[ig.STMT_NO], hashes.to_numpy()):
+        # duplicated statement numbers share one fingerprint
+        fingerprints[stmt_no] = fingerprints.get(stmt_no, "") + format(h, "016x")
+    return fingerprints
+
+
+def find_dependents(df, stmt_nos):
+    dependents = set()
+    for act_cond, stmt_no in zip(df[ig.ACT_COND_REF], df[ig.STMT_NO]):
+        if act_cond != "" and stmt_nos.intersection(
+            rules.referenced_statements(act_cond)
+        ):
+            dependents.add(stmt_no)
+    return dependents
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+class StatementStore:
+    # Persistent build: the ontology lives in an SQLite backed World and the
+    # ig_* tables keep the per statement bookkeeping needed to retract it.
+    def __init__(self, builder):
+        self.builder = builder
+        self.world = builder.world
+        self.onto = builder.onto
+        self.db = self.world.graph.db
+        self.db.executescript(schema)
+
+    def fingerprints(self):
+        return dict(self.db.execute("SELECT stmt_no, fingerprint FROM ig_statements"))
+
+    def _entity(self, name):
+        if name == THING:
+            return owlready2.Thing
+        return self.onto[name]
+
+    def load(self):
+        # restores the in-process indexes of the builder from the store
+        builder = self.builder
+        builder.class_index.clear()
+        builder.class_index.update({c.name: c for c in self.onto.classes()})
+        builder.statement_no_to_classes.clear()
+        for stmt_no, name, parent in self.db.execute(
+            "SELECT stmt_no, class, parent FROM ig_classes ORDER BY rowid"
+        ):
+            parent = None if parent is None else self._entity(parent)
+            builder.statement_no_to_classes.append(stmt_no, self.onto[name], parent)
+        builder.statement_no_to_constituted_subclass.clear()
+        for stmt_no, class_type, name in self.db.execute(
+            "SELECT stmt_no, class_type, class FROM ig_constituted ORDER BY rowid"
+        ):
+            cls = None if name is None else self.onto[name]
+            builder.statement_no_to_constituted_subclass.set(stmt_no, class_type, cls)
+        builder.statement_no_to_realtion.clear()
+        builder.relation_registry = ig.RelationRegistry()
+        for stmt_no, subject, relation_name, object in self.db.execute(
+            "SELECT stmt_no, subject, relation, object FROM ig_relations ORDER BY rowid"
+        ):
+            subject = self.onto[subject]
+            builder.statement_no_to_realtion.append(
+                stmt_no, subject, relation_name, self.onto[object]
+            )
+            builder.relation_registry.register(relation_name, subject)
+        builder.rule_batch = rules.RuleBatch()
+        for rule_str, storid, activation, conclusion in self.db.execute(
+            "SELECT rule, storid, activation, conclusion FROM ig_rules"
+        ):
+            key = rules._canonical_rule(*rules.parse_rule(rule_str))
+            builder.rule_batch.inserted[key] = self.world._get_by_storid(storid)
+            if conclusion is not None:
+                builder.rule_batch.sources[key].add((activation, conclusion))
+
+    def save(self, fingerprints, stmt_nos):
+        # stmt_nos are the statements whose bookkeeping was re-derived, rows
+        # are inserted in their order as load restores them in rowid order
+        builder = self.builder
+        params = [(stmt_no,) for stmt_no in stmt_nos]
+        for table in ["ig_classes", "ig_constituted", "ig_relations"]:
+            self.db.executemany(f"DELETE FROM {table} WHERE stmt_no = ?", params)
+        self.db.executemany(
+            "INSERT INTO ig_classes VALUES (?, ?, ?)",
+            [
+                (stmt_no, cls.name, None if parent is None else _parent_name(parent))
+                for stmt_no in stmt_nos
+                for cls, parent in builder.statement_no_to_classes.get(stmt_no, [])
+            ],
+        )
+        self.db.executemany(
+            "INSERT INTO ig_constituted VALUES (?, ?, ?)",
+            [
+                (stmt_no, class_type, None if cls is None else cls.name)
+                for stmt_no in stmt_nos
+                for class_type, cls in builder.statement_no_to_constituted_subclass.get(
+                    stmt_no
+                )
+            ],
+        )
+        self.db.executemany(
+            "INSERT INTO ig_relations VALUES (?, ?, ?, ?)",
+            [
+                (stmt_no, subject.name, relation_name, object.name)
+                for stmt_no in stmt_nos
+                for subject, relation_name, object in builder.statement_no_to_realtion.get(
+                    stmt_no, []
+                )
+            ],
+        )
+        self.db.execute("DELETE FROM ig_rules")
+        batch = builder.rule_batch
+        self.db.executemany(
+            "INSERT INTO ig_rules VALUES (?, ?, ?, ?)",
+            [
+                (rules.format_rule(*key), rule.storid, *source)
+                for key, rule in batch.inserted.items()
+                for source in (batch.sources.get(key) or [(None, None)])
+            ],
+        )
+        self.db.execute("DELETE FROM ig_statements")
+        self.db.executemany(
+            "INSERT INTO ig_statements VALUES (?, ?)", list(fingerprints.items())
+        )
+        self.world.save()
+
+
+def _parent_name(parent):
+    return THING if parent is owlready2.Thing else parent.name
+
+
+def retract(builder, stmt_nos, rule_stmt_nos):
+    builder.rule_batch.retract(rule_stmt_nos)
+
+    touched_relations = {}
+    touched_classes = {}
+    for stmt_no in stmt_nos:
+        for _, relation_name, _ in builder.statement_no_to_realtion.pop(stmt_no, []):
+            touched_relations[relation_name] = None
+        for cls, _ in builder.statement_no_to_classes.pop(stmt_no, []):
+            touched_classes[cls] = None
+        builder.statement_no_to_constituted_subclass.pop(stmt_no)
+
+    domains = defaultdict(list)
+    builder.relation_registry = ig.RelationRegistry()
+    for entries in builder.statement_no_to_realtion.values():
+        for subject, relation_name, object in entries:
+            builder.relation_registry.register(relation_name, subject)
+            if relation_name in touched_relations:
+                domains[relation_name].append((subject, object))
+    for relation_name in touched_relations:
+        relation = builder.onto[relation_name]
+        if relation_name not in domains:
+            logger.debug(f"Removing relation {relation_name}")
+            owlready2.destroy_entity(relation)
+        else:
+            relation.domain = _unique(s for s, _ in domains[relation_name])
+            relation.range = _unique(o for _, o in domains[relation_name])
+
+    parents = defaultdict(list)
+    for entries in builder.statement_no_to_classes.values():
+        for cls, parent in entries:
+            if cls in touched_classes:
+                parents[cls].append(parent)
+    for cls in touched_classes:
+        if cls not in parents:
+            logger.debug(f"Removing class {cls.name}")
+            builder.class_index.pop(cls.name, None)
+            owlready2.destroy_entity(cls)
+        else:
+            cls.is_a = _unique(p for p in parents[cls] if p is not None) or [
+                owlready2.Thing
+            ]
+    return touched_relations
+
+
+def update(builder, df, structured_provenance=False):
+    # builder must be created on the store file, OntologyBuilder(filename=...)
+    store = StatementStore(builder)
+    fingerprints = fingerprint_statements(df)
+    previous = store.fingerprints()
+    # statements are visited in sheet order (the removed ones in the order of
+    # the previous sheet), never in set order, so that the output does not
+    # depend on string hashing
+    changed = [s for s, f in fingerprints.items() if previous.get(s) != f]
+    removed = [s for s in previous if s not in fingerprints]
+    dirty = changed + removed
+    logger.info(
+        f"Statements changed: {len(changed)}, removed: {len(removed)}, "
+        f"unchanged: {len(fingerprints) - len(changed)}"
+    )
+    if len(dirty) == 0:
+        return
+    rule_stmt_nos = set(dirty) | find_dependents(df, set(dirty))
+
+    store.load()
+    touched_relations = retract(builder, dirty, rule_stmt_nos)
+    builder.build(
+        df[df[ig.STMT_NO].isin(changed)],
+        rules_df=df[df[ig.STMT_NO].isin(rule_stmt_nos)],
+    )
+
+    # provenance of every touched relation is rewritten in statement order
+    for stmt_no in changed:
+        for _, relation_name, _ in builder.statement_no_to_realtion.get(stmt_no, []):
+            touched_relations[relation_name] = None
+    builder.relation_provenance.clear()
+    for stmt_no in fingerprints:
+        for _, relation_name, _ in builder.statement_no_to_realtion.get(stmt_no, []):
+            if relation_name in touched_relations:
+                builder.relation_provenance[builder.onto[relation_name]].append(stmt_no)
+    builder.flush_provenance(structured=structured_provenance)
+
+    store.save(fingerprints, dirty)
@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# aim -> past participle, for aims lemminflect gets wrong
+default_overrides = {"advised": "advised"}
+
+
+class InflectionTable:
+    # Past participles of aims for the passive relation names. Aims are
+    # inflected once per build in prepare, and optionally kept in a JSON file
+    # {"inflections": {...}, "overrides": {...}} between runs; entries under
+    # "overrides" are edited by hand and win over lemminflect.
+    def __init__(self, path=None):
+        self.path = path
+        self.inflections = {}
+        self.overrides = dict(default_overrides)
+        self.changed = False
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            table = json.load(f)
+        self.inflections.update(table.get("inflections", {}))
+        self.overrides.update(table.get("overrides", {}))
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        table = {
+            "inflections": dict(sorted(self.inflections.items())),
+            "overrides": dict(sorted(self.overrides.items())),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(table, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def prepare(self, verbs):
+        missing = {
+            verb
+            for verb in verbs
+            if verb != ""
+            and verb not in self.inflections
+            and verb not in self.overrides
+        }
+        if len(missing) == 0:
+            return
+        import lemminflect
+
+        for verb in sorted(missing):
+            self.inflections[verb] = lemminflect.getInflection(verb, tag="VBD")[0]
+        self.changed = True
+        logger.info(f"Inflected {len(missing)} aims")
+
+    def past(self, verb):
+        past = self.overrides.get(verb) or self.inflections.get(verb)
+        if past is None:
+            if verb == "":
+                raise ValueError("Cannot inflect an empty aim")
+            self.prepare([verb])
+            past = self.inflections[verb]
+        return past
@@ -1,156 +1,340 @@
 import logging
+import os
+from typing import List, Optional
 
-import pandas as pd
 import typer
 
-import ig
-from ig import both, constitutive_columns, create_classes_from_df, regulative_columns
-from rules import define_activation_condition_rules_from_df
+# Each command imports only what it uses: pandas for reading, owlready2 and
+# lemminflect for building.
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+app = typer.Typer()
 
-def main(input_annotation_path: str, output_ontology_path: str = "ig.owl"):
-    # pd.set_option("display.max_colwidth", None)
-    # pd.set_option("display.max_rows", None)
-    # pd.set_option("display.max_columns", None)
-    df = pd.read_excel(
-        input_annotation_path,
-        skiprows=1,
-        dtype=str,
-    )
-    # preprocessign df
-    df = df.fillna("")
-    df = df.applymap(lambda t: t.strip() if type(t) == str else t)
-    ig.check_duplicates(df)
-    df2 = df[
-        [
-            "Activation Condition (Content).1",
-            "Activation Condition (Reference to statement).1",
-            "Execution Constraint (Content).1",
-            "Execution Constraint (Reference to statement).1",
-        ]
-    ]
-    df2 = df2.rename(
-        {
-            a: a[:-2]
-            for a in [
-                "Activation Condition (Content).1",
-                "Activation Condition (Reference to statement).1",
-                "Execution Constraint (Content).1",
-                "Execution Constraint (Reference to statement).1",
-            ]
-        },
-        axis=1,
-    )
-    cols = [
-        "Activation Condition (Content)",
-        "Activation Condition (Reference to statement)",
-        "Execution Constraint (Content)",
-        "Execution Constraint (Reference to statement)",
-    ]
-    for c in cols:
-        df.loc[df2[c] != "", c] = df2[c]
-
-    logger.info(
-        f"Loaded activation conditions(references): {sum(df[ig.ACT_COND_REF]!='')}"
-    )
-    constitutive = df[df[ig.CLASS] == "constitutive"][constitutive_columns + both]
-    regulative = df[df[ig.CLASS] == "regulative"][regulative_columns + both]
-    df_constitutive = constitutive[constitutive[ig.STMT_FUNCTION] == "constitutive"]
-    df_observations = constitutive[constitutive[ig.STMT_FUNCTION] == "observation"]
-    df_reg_observation = regulative[regulative[ig.STMT_FUNCTION] == "observation"]
-    df_regulative = regulative[regulative[ig.STMT_FUNCTION] == "regulative"]
-
-    # Cheks
-    ig.check_observations_constraints(df_observations)
-    ig.check_observations_constraints(df_reg_observation)
-
-    # # Constitutive
-    # ## Constitutive -- observations
-    create_classes_from_df(
-        df_observations[[ig.ENT, ig.CON_FUNC, ig.CON_PROP, ig.CON_PROP_PROP]],
-        statement_nos=df_observations[ig.STMT_NO],
-        connector_word="that",
-    )
-    # ## Constitutive -- proper
-    df_constitutive = df_constitutive[df_constitutive[ig.ENT] != ""]
-    # ### Constitutive -- proper: entities
-    create_classes_from_df(
-        df_constitutive[[ig.ENT, ig.ENT_PROP]],
-        df_constitutive[ig.STMT_NO],
-        class_type=ig.ENT,
-    )
-    # ### Constitutive -- proper: Constituted Properties
-    create_classes_from_df(
-        df_constitutive[[ig.CON_PROP, ig.CON_PROP_PROP]],
-        df_constitutive[ig.STMT_NO],
-        class_type=ig.CON_PROP,
-    )
-    # # Regulative statements
-    # ## Regulative -- observations
-    # ### Regulative -- observations: attr
-    create_classes_from_df(
-        df_reg_observation[[ig.ATTR, ig.ATTR_PROP]],
-        df_reg_observation[ig.STMT_NO],
-        class_type=ig.ATTR,
-    )
-    # ### Regulative -- observations: direct object
-    create_classes_from_df(
-        df_reg_observation[[ig.DIR_OBJ, ig.DIR_OBJ_PROP]],
-        df_reg_observation[ig.STMT_NO],
-        class_type=ig.DIR_OBJ,
-    )
-    # ### Regulative -- observations: indirect objects
-    create_classes_from_df(
-        df_reg_observation[[ig.INDIR_OBJ, ig.INDIR_OBJ_PROP]],
-        df_reg_observation[ig.STMT_NO],
-        class_type=ig.INDIR_OBJ,
-    )
-    # ## Regulative -- proper regulative
-    # ### Regulative -- observations: attr
-    create_classes_from_df(
-        df_regulative[[ig.ATTR, ig.ATTR_PROP]],
-        df_regulative[ig.STMT_NO],
-        class_type=ig.ATTR,
-    )
-    # ### Regulative -- objects
-    create_classes_from_df(
-        df_regulative[[ig.DIR_OBJ, ig.DIR_OBJ_PROP]],
-        df_regulative[ig.STMT_NO],
-        class_type=ig.DIR_OBJ,
-    )
-    # ### Regulative -- indirect objects
-    create_classes_from_df(
-        df_regulative[[ig.INDIR_OBJ, ig.INDIR_OBJ_PROP]],
-        df_regulative[ig.STMT_NO],
-        class_type=ig.INDIR_OBJ,
-    )
-    ig.statement_no_to_constituted_subclass = dict(
-        ig.statement_no_to_constituted_subclass
-    )  # froze dict
-    # # Relations extraction
-    # ### Regulative -- observations:  possible (aim) relations
-    ig.create_relations_from_obserations_aim_from_df(df_reg_observation)
-    # ### Regulative (aim) relations
-    ig.create_relations_from_regulative_aim(
-        df_regulative[[ig.ATTR, ig.ATTR_PROP]],
-        df_regulative[[ig.DEON, ig.AIM]],
-        df_regulative[[ig.DIR_OBJ, ig.DIR_OBJ_PROP]],
-        df_regulative[[ig.INDIR_OBJ, ig.INDIR_OBJ_PROP]],
-        df_regulative[ig.STMT_NO],
+
+def check_input(input_annotation_path):
+    # before any heavy import
+    if not os.path.isfile(input_annotation_path):
+        raise typer.BadParameter(f"File not found: {input_annotation_path}")
+
+
+def check_output(output_ontology_path, output_format, sort_output, output_base):
+    # before the build rather than after it
+    from serialization import resolve_output_format
+
+    try:
+        resolve_output_format(
+            output_ontology_path, output_format, sort_output, output_base
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+
+def check_metrics(metrics_path, metrics_format):
+    from metrics import resolve_metrics_format
+
+    if metrics_path is not None:
+        try:
+            resolve_metrics_format(metrics_path, metrics_format)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+
+
+def read_input(input_annotation_path, input_format, skiprows, sheets, cache=None):
+    from preprocessing import read_annotations
+
+    try:
+        return read_annotations(
+            input_annotation_path, input_format, skiprows, cache, sheets
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+
+@app.command("build")
+def main(
+    input_annotation_path: str,
+    output_ontology_path: str = "ig.owl",
+    structured_provenance: bool = False,
+    incremental_store: Optional[str] = None,
+    input_format: Optional[str] = None,
+    skiprows: int = 1,
+    inflection_cache: Optional[str] = None,
+    metrics_path: Optional[str] = None,
+    metrics_format: Optional[str] = None,
+    profile_stage: Optional[str] = None,
+    profile_mode: str = "cprofile",
+    profile_output: Optional[str] = None,
+    output_format: Optional[str] = None,
+    sort_output: bool = False,
+    output_base: Optional[str] = None,
+    provenance_index: Optional[str] = None,
+    table_cache: Optional[str] = None,
+    table_cache_size: int = 512,
+    sheets: Optional[str] = None,
+):
+    # sheets: "*", or comma separated sheet names or glob patterns
+    # table_cache: directory of normalized tables, table_cache_size in MB
+    # output_format: rdfxml, ntriples or turtle, by default from the extension
+    # of output_ontology_path (.nt, .ttl, .nt.gz, .ttl.gz)
+    # provenance_index: SQLite file mapping statements to what they produced
+    # output_base: absolute IRI the relative class IRIs are resolved against
+    # metrics_path: .json for JSON, Prometheus text format otherwise
+    # profile_stage: stage name as in the metrics, e.g. relations_regulative
+    check_input(input_annotation_path)
+    check_output(output_ontology_path, output_format, sort_output, output_base)
+    check_metrics(metrics_path, metrics_format)
+    from builder import OntologyBuilder
+    from metrics import BuildMetrics
+    from preprocessing import check_annotations
+
+    metrics = BuildMetrics(profile_stage, profile_mode, profile_output)
+    cache = None
+    if table_cache is not None:
+        from table_cache import TableCache
+
+        cache = TableCache(table_cache, table_cache_size << 20)
+    with metrics.capture_warnings():
+        with metrics.stage("read"):
+            df = read_input(
+                input_annotation_path, input_format, skiprows, sheets, cache
+            )
+        with metrics.stage("check"):
+            check_annotations(df)
+        if incremental_store is None:
+            with OntologyBuilder(
+                inflection_cache=inflection_cache, metrics=metrics
+            ) as builder:
+                builder.build(df)
+                builder.save(
+                    output_ontology_path,
+                    structured_provenance,
+                    output_format,
+                    sort_output,
+                    output_base,
+                )
+                if provenance_index is not None:
+                    builder.save_provenance_index(provenance_index)
+        else:
+            import incremental
+
+            with OntologyBuilder(
+                filename=incremental_store,
+                inflection_cache=inflection_cache,
+                metrics=metrics,
+            ) as builder:
+                incremental.update(builder, df, structured_provenance)
+                builder.save(
+                    output_ontology_path,
+                    output_format=output_format,
+                    sort=sort_output,
+                    base=output_base,
+                )
+                if provenance_index is not None:
+                    builder.save_provenance_index(provenance_index)
+    if metrics_path is not None:
+        metrics.write(metrics_path, metrics_format)
+
+
+@app.command("batch")
+def build_batch(
+    input_annotation_paths: List[str],
+    output_ontology_path: str = "ig.owl",
+    processes: Optional[int] = None,
+    input_format: Optional[str] = None,
+    skiprows: int = 1,
+    structured_provenance: bool = False,
+    output_format: Optional[str] = None,
+    sort_output: bool = False,
+    output_base: Optional[str] = None,
+    provenance_index: Optional[str] = None,
+):
+    # builds every document in a worker process and merges them in the given
+    # order, statement numbers prefixed with the document file name
+    for path in input_annotation_paths:
+        check_input(path)
+    check_output(output_ontology_path, output_format, sort_output, output_base)
+    import batch
+
+    try:
+        batch.check_document_names(input_annotation_paths)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    batch.build_documents(
+        input_annotation_paths,
+        output_ontology_path,
+        processes,
+        input_format,
+        skiprows,
+        structured_provenance,
+        output_format,
+        sort_output,
+        output_base,
+        provenance_index,
     )
-    # ### Constitutive (modal, function) relations
-    ig.create_constitutive_modal_function_relations_from_df(df_constitutive)
 
-    # Defining rules
-    # ## Activation conditions
-    define_activation_condition_rules_from_df(df_regulative)
-    define_activation_condition_rules_from_df(df_constitutive)
 
-    ig.onto.save(output_ontology_path)
+@app.command()
+def materialize(
+    ontology_path: str,
+    output_ontology_path: str = "ig.materialized.owl",
+    individuals_path: Optional[str] = None,
+    metrics_path: Optional[str] = None,
+    metrics_format: Optional[str] = None,
+    output_format: Optional[str] = None,
+    sort_output: bool = False,
+    output_base: Optional[str] = None,
+):
+    # applies the rules of ontology_path to its individuals, or to those of
+    # individuals_path, and saves the ontology holding them with the
+    # inferred assertions
+    for path in [ontology_path, individuals_path]:
+        if path is not None:
+            check_input(path)
+    check_output(output_ontology_path, output_format, sort_output, output_base)
+    check_metrics(metrics_path, metrics_format)
+    import owlready2
+
+    from metrics import BuildMetrics
+    from reasoning import materialize as apply_rules
+    from serialization import save_ontology
+
+    metrics = BuildMetrics()
+    world = owlready2.World()
+    with metrics.stage("read"):
+        # rules first, so that an import of them by the individuals resolves
+        onto = world.get_ontology(f"file://{os.path.abspath(ontology_path)}").load()
+        target = onto
+        if individuals_path is not None:
+            target = world.get_ontology(
+                f"file://{os.path.abspath(individuals_path)}"
+            ).load()
+    inferred = apply_rules(onto, target, metrics)
+    logger.info(f"{inferred} assertions inferred")
+    with metrics.stage("save"):
+        save_ontology(
+            target, output_ontology_path, output_format, sort_output, output_base
+        )
+    if metrics_path is not None:
+        metrics.write(metrics_path, metrics_format)
+
+
+@app.command()
+def validate(
+    input_annotation_path: str,
+    report: Optional[str] = None,
+    report_format: Optional[str] = None,
+    input_format: Optional[str] = None,
+    skiprows: int = 1,
+    sheets: Optional[str] = None,
+):
+    check_input(input_annotation_path)
+    import validation
+
+    if report is not None:
+        try:
+            validation.resolve_report_format(report, report_format)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    df = read_input(input_annotation_path, input_format, skiprows, sheets)
+    issues = validation.find_issues(df)
+    for check, count in validation.summarize(issues).items():
+        logger.warning(f"{check}: {count}")
+    logger.info(f"{len(issues)} issues in {issues['statement'].nunique()} statements")
+    if report is not None:
+        validation.write_report(issues, report, report_format, input_annotation_path)
+    if len(issues) > 0:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def diff(
+    old_ontology_path: str,
+    new_ontology_path: str,
+    report: Optional[str] = None,
+    report_format: Optional[str] = None,
+    input_format: Optional[str] = None,
+):
+    # input_format: rdfxml or ntriples, by default from the extensions
+    check_input(old_ontology_path)
+    check_input(new_ontology_path)
+    import comparison
+
+    try:
+        changes = comparison.diff_files(
+            old_ontology_path, new_ontology_path, input_format
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    for line in comparison.format_changes(changes):
+        typer.echo(line)
+    for change, count in comparison.summarize(changes).items():
+        logger.info(f"{change}: {count}")
+    if report is not None:
+        comparison.write_report(
+            changes, report, report_format, old_ontology_path, new_ontology_path
+        )
+    if len(changes) > 0:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def provenance(
+    provenance_index: str,
+    statement: Optional[str] = None,
+    name: Optional[str] = None,
+):
+    # what a statement produced, or the statements a class, relation or rule
+    # (as written by diff) comes from; all statement numbers without either
+    check_input(provenance_index)
+    import json
+
+    from provenance import ProvenanceIndex
+
+    with ProvenanceIndex(provenance_index) as index:
+        if statement is not None:
+            result = index.statement(statement)
+        elif name is not None:
+            result = index.sources(name)
+        else:
+            result = index.statement_numbers()
+    typer.echo(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+def _distinct(column):
+    return column[column != ""].nunique()
+
+
+@app.command()
+def stats(
+    input_annotation_path: str,
+    input_format: Optional[str] = None,
+    skiprows: int = 1,
+    sheets: Optional[str] = None,
+):
+    check_input(input_annotation_path)
+    import ig
+    from preprocessing import split_statements
+
+    df = read_input(input_annotation_path, input_format, skiprows, sheets)
+    df_constitutive, df_observations, df_reg_observation, df_regulative = (
+        split_statements(df)
+    )
+    counts = {
+        "statements": df[ig.STMT_NO].nunique(),
+        "constitutive": len(df_constitutive),
+        "constitutive observations": len(df_observations),
+        "regulative": len(df_regulative),
+        "regulative observations": len(df_reg_observation),
+        "activation conditions": (df[ig.ACT_COND_REF] != "").sum(),
+        "entities": _distinct(df_constitutive[ig.ENT]),
+        "attributes": _distinct(df[ig.ATTR]),
+        "aims": _distinct(df[ig.AIM]),
+    }
+    for name, count in counts.items():
+        typer.echo(f"{name}: {count}")
 
 
 if __name__ == "__main__":
-    typer.run(main)
+    app()
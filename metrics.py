@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+profile_modes = ["cprofile", "tracemalloc"]
+metrics_formats = ["json", "prometheus"]
+
+
+def resolve_metrics_format(metrics_path, metrics_format=None):
+    if metrics_format is None:
+        extension = os.path.splitext(metrics_path)[1].lower()
+        metrics_format = "json" if extension == ".json" else "prometheus"
+    if metrics_format not in metrics_formats:
+        raise ValueError(f"Unsupported metrics format: {metrics_format}")
+    return metrics_format
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows, reported as 0
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class WarningCounter(logging.Handler):
+    # warnings by the function that logged them, e.g. ig.report_missing
+    def __init__(self, counters):
+        super().__init__(level=logging.WARNING)
+        self.counters = counters
+
+    def emit(self, record):
+        if record.levelno == logging.WARNING:
+            self.counters[
+                ("warnings", (("kind", f"{record.module}.{record.funcName}"),))
+            ] += 1
+
+
+class BuildMetrics:
+    # Wall time per build stage with the peak RSS of the process at its end
+    # (the high-water mark so far, not a peak of the stage alone), plus
+    # labelled counters. A stage run more than once adds up to a single
+    # record. profile_stage runs one stage under cProfile or tracemalloc and
+    # writes the result to profile_output.
+    def __init__(
+        self, profile_stage=None, profile_mode="cprofile", profile_output=None
+    ):
+        if profile_mode not in profile_modes:
+            raise ValueError(f"Unsupported profile mode: {profile_mode}")
+        self.stages = []
+        # stage name -> its record in self.stages
+        self.stage_records = {}
+        self.counters = Counter()
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.profile_output = profile_output
+
+    @contextmanager
+    def stage(self, name):
+        profiling = name == self.profile_stage
+        if profiling:
+            profiler = self._start_profile()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {
+                "stage": name,
+                "seconds": time.perf_counter() - start,
+                "process_peak_rss_bytes": peak_rss_bytes(),
+            }
+            if profiling:
+                record.update(self._stop_profile(profiler, name))
+            logger.debug(f"Stage {name}: {record['seconds']:.3f}s")
+            previous = self.stage_records.get(name)
+            if previous is None:
+                self.stages.append(record)
+                self.stage_records[name] = record
+            else:
+                record["seconds"] += previous["seconds"]
+                previous.update(record)
+
+    def count(self, name, value=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    @contextmanager
+    def capture_warnings(self):
+        handler = WarningCounter(self.counters)
+        root = logging.getLogger()
+        root.addHandler(handler)
+        try:
+            yield
+        finally:
+            root.removeHandler(handler)
+
+    def _start_profile(self):
+        if self.profile_mode == "cprofile":
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        import tracemalloc
+
+        tracemalloc.start()
+        return None
+
+    def _stop_profile(self, profiler, name):
+        output = self.profile_output
+        if self.profile_mode == "cprofile":
+            profiler.disable()
+            output = output or f"{name}.prof"
+            profiler.dump_stats(output)
+            logger.info(f"cProfile stats of {name} written to {output}")
+            return {"profile": output}
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        output = output or f"{name}.tracemalloc.txt"
+        with open(output, "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+        logger.info(f"tracemalloc top allocations of {name} written to {output}")
+        return {"profile": output, "traced_peak_bytes": traced_peak}
+
+    def as_dict(self):
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        return {"stages": self.stages, "counters": counters}
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE ig_stage_seconds gauge",
+            *(
+                f'ig_stage_seconds{{stage="{s["stage"]}"}} {s["seconds"]:.6f}'
+                for s in self.stages
+            ),
+            "# TYPE ig_stage_process_peak_rss_bytes gauge",
+            *(
+                f'ig_stage_process_peak_rss_bytes{{stage="{s["stage"]}"}} '
+                f'{s["process_peak_rss_bytes"]}'
+                for s in self.stages
+            ),
+        ]
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = f"ig_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(
+                f"{metric}{{{label_str}}} {value}" if label_str else f"{metric} {value}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_path, metrics_format=None):
+        metrics_format = resolve_metrics_format(metrics_path, metrics_format)
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            if metrics_format == "json":
+                json.dump(self.as_dict(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
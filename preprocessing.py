@@ -0,0 +1,320 @@
+import fnmatch
+import logging
+import multiprocessing
+import os
+import re
+
+import pandas as pd
+
+import ig
+
+logger = logging.getLogger(__name__)
+
+# Regulative columns sharing a header with a constitutive one are read by pandas
+# with a ".1" suffix; their values override the constitutive ones when present.
+shadowed_columns = [
+    ig.ACT_COND,
+    ig.ACT_COND_REF,
+    ig.EXEC_CONSTR,
+    ig.EXEC_CONSTR_REF,
+]
+categorical_columns = [ig.CLASS, ig.STMT_FUNCTION]
+
+
+input_formats = {
+    ".xlsx": "xlsx",
+    ".xlsm": "xlsx",
+    ".xls": "xls",
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".tab": "tsv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+
+def detect_format(input_annotation_path):
+    input_format = input_formats.get(os.path.splitext(input_annotation_path)[1].lower())
+    if input_format is not None:
+        return input_format
+    with open(input_annotation_path, "rb") as f:
+        head = f.read(4096)
+    if head.startswith(b"PK"):
+        return "xlsx"
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "xls"
+    first_line = head.split(b"\n", 1)[0]
+    return "tsv" if first_line.count(b"\t") > first_line.count(b",") else "csv"
+
+
+def read_annotations(
+    input_annotation_path,
+    input_format=None,
+    skiprows=1,
+    cache=None,
+    sheets=None,
+    processes=None,
+):
+    # skiprows: rows above the header, exports of the annotation sheet keep them
+    # cache: table_cache.TableCache holding normalized tables
+    # sheets: workbook sheets to read together (see select_sheets), by
+    # default the active one; processes: sheets read in parallel
+    if input_format is None:
+        input_format = detect_format(input_annotation_path)
+    if cache is None:
+        return _read_annotations(
+            input_annotation_path, input_format, skiprows, sheets, processes
+        )
+    key = cache.key(input_annotation_path, input_format, skiprows, sheets)
+    df = cache.get(key)
+    if df is not None:
+        logger.info(f"Read {input_annotation_path} from the table cache")
+        return df
+    df = _read_annotations(
+        input_annotation_path, input_format, skiprows, sheets, processes
+    )
+    cache.put(key, df)
+    return df
+
+
+def _read_annotations(input_annotation_path, input_format, skiprows, sheets, processes):
+    if sheets is not None:
+        return read_sheets(
+            input_annotation_path, input_format, skiprows, sheets, processes
+        )
+    return _read_table(input_annotation_path, input_format, skiprows)
+
+
+def _read_table(input_annotation_path, input_format, skiprows, sheet_name=None):
+    sheet = "" if sheet_name is None else f", sheet {sheet_name}"
+    logger.info(f"Reading {input_annotation_path} as {input_format}{sheet}")
+    if input_format == "xlsx":
+        df = read_xlsx(input_annotation_path, skiprows=skiprows, sheet_name=sheet_name)
+    elif input_format in ("csv", "tsv"):
+        df = pd.read_csv(
+            input_annotation_path,
+            sep="\t" if input_format == "tsv" else ",",
+            skiprows=skiprows,
+            dtype=str,
+            keep_default_na=False,
+        )
+    elif input_format == "parquet":
+        df = pd.read_parquet(input_annotation_path)
+    elif input_format == "xls":
+        df = pd.read_excel(
+            input_annotation_path,
+            sheet_name=0 if sheet_name is None else sheet_name,
+            skiprows=skiprows,
+            dtype=str,
+            keep_default_na=False,
+        )
+    else:
+        raise ValueError(f"Unsupported input format: {input_format}")
+    return normalize_annotations(df)
+
+
+def sheet_names(input_annotation_path, input_format):
+    if input_format == "xlsx":
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(input_annotation_path, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    if input_format == "xls":
+        with pd.ExcelFile(input_annotation_path) as workbook:
+            return workbook.sheet_names
+    raise ValueError(f"{input_format} input has no sheets")
+
+
+def select_sheets(names, sheets):
+    # sheets: "*" for all of them, or comma separated names or glob patterns
+    # as in "Chapter 1,Annex*"; selected sheets keep the workbook order
+    selected = set()
+    for pattern in sheets.split(","):
+        pattern = pattern.strip()
+        matches = [
+            name
+            for name in names
+            if name == pattern or fnmatch.fnmatchcase(name, pattern)
+        ]
+        if len(matches) == 0:
+            raise ValueError(f"No sheet matches '{pattern}' in {names}")
+        selected.update(matches)
+    return [name for name in names if name in selected]
+
+
+def sheet_prefix(sheet_name):
+    # statement number prefix of a sheet, a single activation condition token
+    return re.sub(r"[\s\[\],]+", "_", sheet_name.strip())
+
+
+def read_sheets(
+    input_annotation_path, input_format=None, skiprows=1, sheets="*", processes=None
+):
+    # One table from several sheets of a workbook, read and normalized by a
+    # pool of processes. Statement numbers used by more than one sheet are
+    # prefixed with the sheet ("Chapter_1:1.2") in every sheet using them,
+    # see SheetReferences for the activation condition references.
+    if input_format is None:
+        input_format = detect_format(input_annotation_path)
+    names = select_sheets(sheet_names(input_annotation_path, input_format), sheets)
+    prefixes = [sheet_prefix(name) for name in names]
+    if len(set(prefixes)) != len(prefixes):
+        raise ValueError(f"Sheet names must differ in more than spacing: {names}")
+    tasks = [(input_annotation_path, input_format, skiprows, name) for name in names]
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    if processes == 1:
+        tables = [_read_table(*task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            tables = pool.starmap(_read_table, tasks, chunksize=1)
+
+    sheets_of = {}
+    for prefix, table in zip(prefixes, tables):
+        for stmt_no in set(table[ig.STMT_NO]):
+            sheets_of.setdefault(stmt_no, []).append(prefix)
+    clashing = {s for s, p in sheets_of.items() if s != "" and len(p) > 1}
+    if len(clashing) > 0:
+        logger.info(
+            f"Prefixing {len(clashing)} statement numbers used by several sheets"
+        )
+    for prefix, table in zip(prefixes, tables):
+        references = SheetReferences(prefix, table[ig.STMT_NO], clashing, prefixes)
+        table[ig.STMT_NO] = [
+            f"{prefix}:{s}" if s in references.own else s for s in table[ig.STMT_NO]
+        ]
+        table[ig.ACT_COND_REF] = [
+            references.resolve(refs) for refs in table[ig.ACT_COND_REF]
+        ]
+        if len(references.ambiguous) > 0:
+            example = sheets_of[min(references.ambiguous)][0]
+            logger.warning(
+                f"References from sheet {prefix} to statement numbers of several "
+                f"other sheets are left unresolved, write them with the sheet, "
+                f"as in {example}:{min(references.ambiguous)}: "
+                f"{sorted(references.ambiguous)}"
+            )
+    df = pd.concat(tables, ignore_index=True)
+    # categories differ between sheets, concat falls back to strings
+    df[categorical_columns] = df[categorical_columns].astype("category")
+    return df
+
+
+class SheetReferences:
+    # Activation condition references of one sheet in the merged table:
+    # references to its statement numbers used by other sheets too get its
+    # prefix, references written with a sheet prefix lose it when the
+    # statement number is not prefixed.
+    def __init__(self, prefix, stmt_nos, clashing, prefixes):
+        self.prefix = prefix
+        self.own = clashing.intersection(stmt_nos)
+        self.clashing = clashing
+        self.prefixes = set(prefixes)
+        # references to statement numbers of several other sheets
+        self.ambiguous = set()
+
+    def resolve(self, act_cond_str):
+        from rules import reference_regex
+
+        return reference_regex.sub(self._resolve, act_cond_str)
+
+    def _resolve(self, match):
+        ref = match.group(0)
+        if ref in self.own:
+            return f"{self.prefix}:{ref}"
+        if ref in self.clashing:
+            self.ambiguous.add(ref)
+            return ref
+        prefix, colon, stmt_no = ref.partition(":")
+        if colon and prefix in self.prefixes and stmt_no not in self.clashing:
+            return stmt_no
+        return ref
+
+
+def _mangle_duplicates(header):
+    # same names as pandas gives to repeated headers: "X", "X.1", "X.2", ...
+    seen = {}
+    mangled = []
+    for name in header:
+        name = "" if name is None else str(name)
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        mangled.append(name if count == 0 else f"{name}.{count}")
+    return mangled
+
+
+def _cell_to_str(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_xlsx(input_annotation_path, skiprows=1, sheet_name=None):
+    import openpyxl
+
+    # read-only openpyxl streams rows without loading cell styles
+    workbook = openpyxl.load_workbook(
+        input_annotation_path, read_only=True, data_only=True, keep_links=False
+    )
+    try:
+        sheet = workbook.active if sheet_name is None else workbook[sheet_name]
+        rows = sheet.iter_rows(min_row=skiprows + 1, values_only=True)
+        header = _mangle_duplicates(next(rows, ()))
+        records = [
+            [_cell_to_str(value) for value in row]
+            for row in rows
+            if any(value is not None for value in row)
+        ]
+    finally:
+        workbook.close()
+    width = len(header)
+    records = [record[:width] + [""] * (width - len(record)) for record in records]
+    return pd.DataFrame(records, columns=header)
+
+
+def normalize_annotations(df):
+    # every cell becomes a stripped string, column by column
+    columns = list(
+        dict.fromkeys(
+            [ig.CLASS] + ig.constitutive_columns + ig.regulative_columns + ig.both
+        )
+    )
+    shadows = [c + ".1" for c in shadowed_columns]
+    table = df.reindex(columns=columns + shadows).fillna("")
+    table = table.apply(lambda column: column.astype(str).str.strip())
+    for column, shadow in zip(shadowed_columns, shadows):
+        table[column] = table[column].where(table[shadow] == "", table[shadow])
+    table = table.drop(columns=shadows)
+    table[categorical_columns] = table[categorical_columns].astype("category")
+    logger.info(
+        f"Loaded activation conditions(references): {sum(table[ig.ACT_COND_REF]!='')}"
+    )
+    return table
+
+
+def check_annotations(df):
+    # returns the statement numbers with problems, the checks log them
+    _, df_observations, df_reg_observation, _ = split_statements(df)
+    return (
+        ig.check_duplicates(df)
+        + ig.check_observations_constraints(df_observations)
+        + ig.check_observations_constraints(df_reg_observation)
+    )
+
+
+def split_statements(table):
+    constitutive = table[table[ig.CLASS] == "constitutive"][
+        ig.constitutive_columns + ig.both
+    ]
+    regulative = table[table[ig.CLASS] == "regulative"][ig.regulative_columns + ig.both]
+    df_constitutive = constitutive[constitutive[ig.STMT_FUNCTION] == "constitutive"]
+    df_observations = constitutive[constitutive[ig.STMT_FUNCTION] == "observation"]
+    df_reg_observation = regulative[regulative[ig.STMT_FUNCTION] == "observation"]
+    df_regulative = regulative[regulative[ig.STMT_FUNCTION] == "regulative"]
+    return df_constitutive, df_observations, df_reg_observation, df_regulative
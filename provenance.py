@@ -0,0 +1,144 @@
+import os
+import sqlite3
+from collections import defaultdict
+
+# Statement provenance of a build as a standalone SQLite file: statement
+# number -> classes, relations and rules, and back. Written next to the
+# ontology, read without loading it.
+
+THING = "owl:Thing"
+
+schema = """
+CREATE TABLE classes (stmt_no TEXT, class TEXT, parent TEXT);
+CREATE TABLE relations (stmt_no TEXT, subject TEXT, relation TEXT, object TEXT);
+CREATE TABLE rules (stmt_no TEXT, role TEXT, rule TEXT);
+"""
+# created once the rows are in, which is faster than maintaining them
+indexes = """
+CREATE INDEX classes_stmt ON classes (stmt_no);
+CREATE INDEX classes_class ON classes (class);
+CREATE INDEX relations_stmt ON relations (stmt_no);
+CREATE INDEX relations_relation ON relations (relation);
+CREATE INDEX rules_stmt ON rules (stmt_no);
+CREATE INDEX rules_rule ON rules (rule);
+"""
+# role of a statement in a rule: its activation condition or its conclusion
+roles = ["activation", "conclusion"]
+
+
+def index_rows(builder):
+    # rows of the three tables from the bookkeeping of a built builder
+    import owlready2
+
+    from rules import format_rule
+
+    classes = [
+        (
+            stmt_no,
+            cls.name,
+            None if p is None else THING if p is owlready2.Thing else p.name,
+        )
+        for stmt_no, entries in builder.statement_no_to_classes.items()
+        for cls, p in entries
+    ]
+    relations = [
+        (stmt_no, subject.name, relation_name, object.name)
+        for stmt_no, entries in builder.statement_no_to_realtion.items()
+        if stmt_no is not None
+        for subject, relation_name, object in entries
+    ]
+    batch = builder.rule_batch
+    rules = [
+        (stmt_no, role, format_rule(*key))
+        for key in batch.inserted
+        for source in sorted(batch.sources.get(key, ()))
+        for role, stmt_no in zip(roles, source)
+    ]
+    # a statement is the activation of a rule once per conclusion
+    return classes, relations, list(dict.fromkeys(rules))
+
+
+def write_index(builder, path):
+    # replaces path at once, readers never see a partial index
+    classes, relations, rules = index_rows(builder)
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    db = sqlite3.connect(partial)
+    try:
+        db.executescript(schema)
+        db.executemany("INSERT INTO classes VALUES (?, ?, ?)", classes)
+        db.executemany("INSERT INTO relations VALUES (?, ?, ?, ?)", relations)
+        db.executemany("INSERT INTO rules VALUES (?, ?, ?)", rules)
+        db.executescript(indexes)
+        db.commit()
+    finally:
+        db.close()
+    os.replace(partial, path)
+    return len(classes) + len(relations) + len(rules)
+
+
+class ProvenanceIndex:
+    # Read only lookups over a file written by write_index
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Provenance index not found: {path}")
+        self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def statement(self, stmt_no):
+        # what statement stmt_no produced
+        return {
+            "classes": self._records(
+                "SELECT class, parent FROM classes WHERE stmt_no = ? ORDER BY rowid",
+                stmt_no,
+            ),
+            "relations": self._records(
+                "SELECT subject, relation, object FROM relations "
+                "WHERE stmt_no = ? ORDER BY rowid",
+                stmt_no,
+            ),
+            "rules": self._records(
+                "SELECT role, rule FROM rules WHERE stmt_no = ? ORDER BY rowid",
+                stmt_no,
+            ),
+        }
+
+    def _records(self, query, *params):
+        cursor = self.db.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def sources(self, name):
+        # statements that produced the class, relation or rule called name;
+        # rules are named as format_rule writes them
+        found = defaultdict(list)
+        queries = {
+            "class": "SELECT DISTINCT stmt_no FROM classes WHERE class = ?",
+            "relation": "SELECT DISTINCT stmt_no FROM relations WHERE relation = ?",
+        }
+        for kind, query in queries.items():
+            for (stmt_no,) in self.db.execute(query, (name,)):
+                found[kind].append(stmt_no)
+        for role, stmt_no in self.db.execute(
+            "SELECT DISTINCT role, stmt_no FROM rules WHERE rule = ?", (name,)
+        ):
+            found[role].append(stmt_no)
+        return dict(found)
+
+    def statement_numbers(self):
+        return [
+            stmt_no
+            for (stmt_no,) in self.db.execute(
+                "SELECT stmt_no FROM classes UNION SELECT stmt_no FROM relations "
+                "UNION SELECT stmt_no FROM rules"
+            )
+        ]
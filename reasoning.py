@@ -0,0 +1,396 @@
+import gc
+import itertools
+import logging
+from operator import itemgetter
+from collections import defaultdict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Forward chaining over the SWRL rules of an ontology, for the class and
+# property atoms get_rule produces. Facts are storid tuples read from the
+# owlready2 quadstore: (individual,) per class, (subject, object) per property.
+# A class atom matches the individuals asserted in the class or one of its
+# subclasses; there is no other OWL entailment.
+
+# predicate is a storid, args are variable names or individual storids
+Atom = namedtuple("Atom", ["predicate", "args"])
+Rule = namedtuple("Rule", ["body", "head"])
+
+
+def rules_from_ontology(onto):
+    import owlready2
+
+    def convert(atom):
+        if isinstance(atom, owlready2.ClassAtom) and isinstance(
+            atom.class_predicate, owlready2.ThingClass
+        ):
+            predicate = atom.class_predicate
+        elif isinstance(atom, owlready2.IndividualPropertyAtom):
+            predicate = atom.property_predicate
+        else:
+            return None
+        args = tuple(
+            arg.name if isinstance(arg, owlready2.Variable) else arg.storid
+            for arg in atom.arguments
+        )
+        return Atom(predicate.storid, args)
+
+    rules = []
+    for imp in onto.rules():
+        body = [convert(atom) for atom in imp.body]
+        head = [convert(atom) for atom in imp.head]
+        if None in body or None in head:
+            logger.warning(f"Skipping rule with unsupported atoms: {imp}")
+            continue
+        rules.append(Rule(tuple(body), tuple(head)))
+    return rules
+
+
+class CompiledRule:
+    # The body split into groups of atoms connected by shared variables. Each
+    # group is joined on its own and projected on the head variables; groups
+    # without head variables only need one match.
+    def __init__(self, rule):
+        self.body = rule.body
+        self.head = rule.head
+        head_variables = {a for atom in rule.head for a in atom.args if _is_var(a)}
+        self.groups = []
+        for atom_ids in _connected_groups(rule.body):
+            variables = {a for i in atom_ids for a in rule.body[i].args if _is_var(a)}
+            outputs = tuple(sorted(variables & head_variables))
+            self.groups.append((atom_ids, outputs))
+        # a match is the concatenation of one row per group
+        bound = [v for _, outputs in self.groups for v in outputs]
+        if not head_variables <= set(bound):
+            raise ValueError(f"Unbound head variables in rule {rule}")
+        self.head_facts = [
+            (atom.predicate, _head_fact(atom.args, bound)) for atom in rule.head
+        ]
+
+
+def _is_var(arg):
+    return isinstance(arg, str)
+
+
+def _connected_groups(atoms):
+    groups = []
+    for i, atom in enumerate(atoms):
+        variables = {a for a in atom.args if _is_var(a)}
+        merged = [i]
+        for group in list(groups):
+            if variables & group[1]:
+                groups.remove(group)
+                merged += group[0]
+                variables |= group[1]
+        groups.append((merged, variables))
+    return [sorted(atom_ids) for atom_ids, _ in groups]
+
+
+class ForwardChainer:
+    # Semi-naive evaluation to a fixpoint: after the first round a rule is
+    # only evaluated from the facts derived in the previous round, joined by
+    # hash lookups on the facts known so far.
+    def __init__(self, world, rules):
+        self.world = world
+        self.rules = [CompiledRule(rule) for rule in rules]
+        # predicate -> set of fact tuples
+        self.facts = defaultdict(set)
+        # predicate -> key positions -> (key function, key -> facts)
+        self.indexes = defaultdict(dict)
+        # rows of the groups without new facts, valid for one round
+        self.group_rows = {}
+        # class -> classes of the rule atoms it is a subclass of
+        self.superclasses = defaultdict(list)
+        self.inferred = defaultdict(set)
+        self.rounds = 0
+
+    def load(self):
+        import owlready2
+
+        graph = self.world.graph
+        arity = {}
+        for rule in self.rules:
+            for atom in (*rule.body, *rule.head):
+                arity[atom.predicate] = len(atom.args)
+        children = defaultdict(list)
+        for s, o in graph.execute(
+            "SELECT s, o FROM objs WHERE p = ? AND s > 0 AND o > 0",
+            (owlready2.rdfs_subclassof,),
+        ):
+            children[o].append(s)
+        members = {}
+        properties = []
+        for predicate, n in arity.items():
+            if n == 1:
+                for subclass in _descendants(children, predicate):
+                    if subclass not in members:
+                        members[subclass] = graph.execute(
+                            "SELECT s FROM objs WHERE p = ? AND o = ?",
+                            (owlready2.rdf_type, subclass),
+                        ).fetchall()
+                    self.superclasses[subclass].append(predicate)
+                    self.facts[predicate].update(members[subclass])
+            else:
+                properties.append(predicate)
+        # no index starts with p: one table scan for many properties
+        for i in range(0, len(properties), 500):
+            chunk = properties[i : i + 500]
+            for p, s, o in graph.execute(
+                "SELECT p, s, o FROM objs WHERE p IN "
+                f"({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                self.facts[p].add((s, o))
+        logger.info(
+            f"Loaded {sum(map(len, self.facts.values()))} facts for "
+            f"{len(self.rules)} rules"
+        )
+
+    def run(self):
+        # first round from all facts, then from the new ones only
+        delta = self.fire_all(None)
+        while len(delta) > 0:
+            delta = self.fire_all(delta)
+        logger.info(
+            f"Inferred {sum(map(len, self.inferred.values()))} facts "
+            f"in {self.rounds} rounds"
+        )
+        return self.inferred
+
+    def fire_all(self, delta):
+        self.rounds += 1
+        self.group_rows.clear()
+        new = defaultdict(set)
+        for rule in self.rules:
+            if delta is None:
+                self.fire(rule, new)
+                continue
+            for i, atom in enumerate(rule.body):
+                if len(delta.get(atom.predicate, ())) > 0:
+                    self.fire(rule, new, i, delta[atom.predicate])
+        # added after the round, so every rule sees the same facts
+        added = defaultdict(set)
+        for predicate, facts in new.items():
+            for fact in facts:
+                if fact in self.facts[predicate]:
+                    continue
+                self.inferred[predicate].add(fact)
+                if len(fact) == 1:
+                    # members of a class are members of its superclasses
+                    for superclass in self.superclasses.get(predicate, [predicate]):
+                        self.add(superclass, fact, added)
+                else:
+                    self.add(predicate, fact, added)
+        return added
+
+    def add(self, predicate, fact, added):
+        facts = self.facts[predicate]
+        if fact in facts:
+            return
+        facts.add(fact)
+        added[predicate].add(fact)
+        for key, index in self.indexes[predicate].values():
+            index[key(fact)].append(fact)
+
+    def fire(self, rule, new, delta_atom=None, delta_facts=None):
+        # the group with the new facts first, the others may then be skipped
+        results = [None] * len(rule.groups)
+        for g, (atom_ids, outputs) in sorted(
+            enumerate(rule.groups), key=lambda group: delta_atom not in group[1][0]
+        ):
+            if delta_atom in atom_ids:
+                rows = self.join(rule.body, atom_ids, outputs, delta_atom, delta_facts)
+            else:
+                key = (id(rule), g)
+                rows = self.group_rows.get(key)
+                if rows is None:
+                    rows = self.group_rows[key] = self.join(
+                        rule.body, atom_ids, outputs
+                    )
+            if len(rows) == 0:
+                return
+            results[g] = rows
+        for predicate, head_fact in rule.head_facts:
+            facts = self.facts[predicate]
+            new[predicate].update(
+                fact
+                for fact in map(head_fact, itertools.product(*results))
+                if fact not in facts
+            )
+
+    def join(self, atoms, atom_ids, outputs, start=None, start_facts=None):
+        # rows of values of the bound variables, projected at every step on
+        # the variables still needed. A group is connected, so the next atom
+        # always shares a bound variable.
+        remaining = list(atom_ids)
+        if start is None:
+            start = min(remaining, key=lambda i: len(self.facts[atoms[i].predicate]))
+            start_facts = self.facts[atoms[start].predicate]
+        remaining.remove(start)
+        variables, rows = _match(atoms[start], start_facts)
+        while len(rows) > 0:
+            needed = set(outputs)
+            for i in remaining:
+                needed.update(a for a in atoms[i].args if _is_var(a))
+            keep = [k for k, v in enumerate(variables) if v in needed]
+            if len(keep) < len(variables):
+                variables = tuple(variables[k] for k in keep)
+                rows = {tuple(row[k] for k in keep) for row in rows}
+            if len(remaining) == 0:
+                break
+            # the atom sharing most bound variables, then the smallest
+            i = max(
+                remaining,
+                key=lambda i: (
+                    len(set(atoms[i].args) & set(variables)),
+                    -len(self.facts[atoms[i].predicate]),
+                ),
+            )
+            remaining.remove(i)
+            variables, rows = self.extend(atoms[i], variables, rows)
+        return {tuple(row[variables.index(v)] for v in outputs) for row in rows}
+
+    def extend(self, atom, variables, rows):
+        positions = tuple(p for p, a in enumerate(atom.args) if a in variables)
+        new_variables = []
+        for a in atom.args:
+            if _is_var(a) and a not in variables and a not in new_variables:
+                new_variables.append(a)
+        index = self.index(atom.predicate, positions)
+        row_key = itemgetter(*(variables.index(atom.args[p]) for p in positions))
+        extended = set()
+        if len(new_variables) == 0:
+            # a filter on the rows; the index key holds every argument
+            extended.update(row for row in rows if row_key(row) in index)
+        elif _is_plain(atom):
+            # neither constants nor repeated variables, nothing to check
+            values = _getter(atom.args.index(v) for v in new_variables)
+            for row in rows:
+                for fact in index.get(row_key(row), ()):
+                    extended.add(row + values(fact))
+        else:
+            for row in rows:
+                for fact in index.get(row_key(row), ()):
+                    values = _bind(atom.args, fact, new_variables)
+                    if values is not None:
+                        extended.add(row + values)
+        return tuple(variables) + tuple(new_variables), extended
+
+    def index(self, predicate, positions):
+        # facts by the values at positions, a value or a tuple of values as
+        # itemgetter returns them
+        indexes = self.indexes[predicate]
+        if positions not in indexes:
+            key = itemgetter(*positions)
+            index = defaultdict(list)
+            for fact in self.facts[predicate]:
+                index[key(fact)].append(fact)
+            indexes[positions] = (key, index)
+        return indexes[positions][1]
+
+    def write(self, target):
+        # inferred facts as triples of the target ontology, straight into the
+        # quadstore; entities loaded before see them once reloaded
+        import owlready2
+
+        c = target.graph.c
+        rows = []
+        for predicate, facts in self.inferred.items():
+            for fact in facts:
+                if len(fact) == 1:
+                    rows.append((c, fact[0], owlready2.rdf_type, predicate))
+                else:
+                    rows.append((c, fact[0], predicate, fact[1]))
+        self.world.graph.db.executemany("INSERT INTO objs VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+
+def _match(atom, facts):
+    variables = []
+    for a in atom.args:
+        if _is_var(a) and a not in variables:
+            variables.append(a)
+    if _is_plain(atom):
+        # the facts are the rows; they are only read until the round ends
+        return tuple(variables), facts
+    rows = set()
+    for fact in facts:
+        values = _bind(atom.args, fact, variables)
+        if values is not None:
+            rows.add(values)
+    return tuple(variables), rows
+
+
+def _bind(args, fact, variables):
+    # values of variables in fact, None if a constant or a repeated variable
+    # does not match
+    binding = {}
+    for a, value in zip(args, fact):
+        if not _is_var(a):
+            if a != value:
+                return None
+        elif binding.setdefault(a, value) != value:
+            return None
+    return tuple(binding[v] for v in variables)
+
+
+def _head_fact(args, bound):
+    # fact of a head atom from a match, a tuple of group rows
+    def head_fact(match):
+        values = [value for row in match for value in row]
+        return tuple(values[bound.index(a)] if _is_var(a) else a for a in args)
+
+    if all(_is_var(a) for a in args):
+        getter = _getter(bound.index(a) for a in args)
+        return lambda match: getter(sum(match, ()))
+    return head_fact
+
+
+def _is_plain(atom):
+    return all(_is_var(a) for a in atom.args) and len(set(atom.args)) == len(atom.args)
+
+
+def _getter(positions):
+    # a tuple of the values at positions, even for a single one
+    positions = list(positions)
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda fact: (fact[position],)
+    return itemgetter(*positions)
+
+
+def _descendants(children, cls):
+    seen = {cls}
+    stack = [cls]
+    while len(stack) > 0:
+        for child in children.get(stack.pop(), ()):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return seen
+
+
+def materialize(onto, target=None, metrics=None):
+    # applies the rules of onto to the individuals of its world and adds the
+    # inferred assertions to target (onto by default); returns their number
+    from metrics import BuildMetrics
+
+    metrics = BuildMetrics() if metrics is None else metrics
+    chainer = ForwardChainer(onto.world, rules_from_ontology(onto))
+    # millions of fact tuples without reference cycles: the cyclic collector
+    # would only traverse them over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        with metrics.stage("materialize_load"):
+            chainer.load()
+        with metrics.stage("materialize_run"):
+            chainer.run()
+        with metrics.stage("materialize_write"):
+            written = chainer.write(onto if target is None else target)
+    finally:
+        if collecting:
+            gc.enable()
+    metrics.count("materialize_rounds", chainer.rounds)
+    metrics.count("facts_inferred", written)
+    return written
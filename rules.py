@@ -1,123 +1,456 @@
+import heapq
+import itertools
 import logging
+import re
+from collections import defaultdict, namedtuple
 
-import owlready2
+logger = logging.getLogger(__name__)
 
-import ig
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+# Activation condition references: "1.2", "[1.2]", "OR[1.2,1.3]",
+# "AND[1.2,1.3]", "NOT[1.2]" or "NOT 1.2", nested as in "AND[1.2,OR[1.3,1.4]]".
+# A condition is ("REF", stmt_no) or (operator, operands).
+Condition = namedtuple("Condition", ["op", "operands"])
+operators = ("AND", "OR", "NOT")
+
+# a statement number or operator in a reference
+reference_regex = re.compile(r"[^\s\[\],]+")
+_token_regex = re.compile(r"\[|\]|,|[^\s\[\],]+")
+
+
+def parse_condition(act_cond_str):
+    tokens = _token_regex.findall(act_cond_str)
+    condition, end = _parse_condition(tokens, 0, act_cond_str)
+    if end != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[end]}' in '{act_cond_str}'")
+    return condition
+
+
+def _parse_condition(tokens, i, act_cond_str):
+    if i == len(tokens):
+        raise ValueError(f"Incomplete activation condition '{act_cond_str}'")
+    token = tokens[i]
+    if token in operators:
+        if i + 1 < len(tokens) and tokens[i + 1] == "[":
+            operands, i = _parse_operands(tokens, i + 2, act_cond_str)
+        else:
+            operand, i = _parse_condition(tokens, i + 1, act_cond_str)
+            operands = [operand]
+        if token == "NOT" and len(operands) != 1:
+            raise ValueError(f"NOT takes one operand in '{act_cond_str}'")
+        return Condition(token, tuple(operands)), i
+    if token == "[":
+        operands, i = _parse_operands(tokens, i + 1, act_cond_str)
+        if len(operands) != 1:
+            raise ValueError(f"Expected one reference in '{act_cond_str}'")
+        return operands[0], i
+    if token in ("]", ","):
+        raise ValueError(f"Unexpected '{token}' in '{act_cond_str}'")
+    return Condition("REF", token), i + 1
+
+
+def _parse_operands(tokens, i, act_cond_str):
+    # operands up to the closing bracket, i is past the opening one
+    operands = []
+    while True:
+        operand, i = _parse_condition(tokens, i, act_cond_str)
+        operands.append(operand)
+        if i == len(tokens):
+            raise ValueError(f"Missing ']' in '{act_cond_str}'")
+        if tokens[i] == "]":
+            return operands, i + 1
+        if tokens[i] != ",":
+            raise ValueError(f"Unexpected '{tokens[i]}' in '{act_cond_str}'")
+        i += 1
+
+
+def condition_statements(condition):
+    if condition.op == "REF":
+        return [condition.operands]
+    return [s for operand in condition.operands for s in condition_statements(operand)]
+
+
+def disjunctive_form(condition, negation=False):
+    # alternatives of conjoined (stmt_no, negated) literals, NOT pushed down
+    # to the references
+    op = condition.op
+    if op == "REF":
+        return [((condition.operands, negation),)]
+    if op == "NOT":
+        return disjunctive_form(condition.operands[0], not negation)
+    alternatives = [disjunctive_form(o, negation) for o in condition.operands]
+    if (op == "OR") != negation:
+        return [conjunction for a in alternatives for conjunction in a]
+    return [
+        tuple(literal for conjunction in combination for literal in conjunction)
+        for combination in itertools.product(*alternatives)
+    ]
+
+
+def referenced_statements(act_cond_str):
+    return [
+        ref for ref in reference_regex.findall(act_cond_str) if ref not in operators
+    ]
+
+
+class ConditionGraph:
+    # Statement dependency graph of the activation conditions, parsed once:
+    # a statement depends on the statements its condition references.
+    def __init__(self):
+        # stmt_no -> Condition, in sheet order
+        self.conditions = {}
+        # stmt_no -> reference string that could not be parsed
+        self.invalid = {}
 
+    def add(self, stmt_no, act_cond_str):
+        if act_cond_str == "":
+            return
+        try:
+            condition = parse_condition(act_cond_str)
+        except ValueError as e:
+            logger.warning(f"Activation condition of statement {stmt_no}: {e}")
+            self.invalid[stmt_no] = act_cond_str
+            return
+        previous = self.conditions.get(stmt_no)
+        if previous is not None:
+            # rows sharing a statement number apply alternatively
+            condition = Condition("OR", (previous, condition))
+        self.conditions[stmt_no] = condition
 
-def get_act_cond(act_cond_str):
-    if act_cond_str[:2] == "OR":
-        return act_cond_str[3:-1].split(",")
-    if act_cond_str[:3] == "AND":
-        return act_cond_str
-    else:
-        return act_cond_str.strip("[]")
+    def dependencies(self, stmt_no):
+        return list(dict.fromkeys(condition_statements(self.conditions[stmt_no])))
 
+    def dangling(self, known):
+        dangling = {}
+        for stmt_no in self.conditions:
+            missing = [s for s in self.dependencies(stmt_no) if s not in known]
+            if len(missing) > 0:
+                dangling[stmt_no] = missing
+        return dangling
 
-def _check_subclasses(a, b):
+    def cycles(self):
+        # strongly connected components of more than one statement, or of a
+        # statement referencing itself (Tarjan, without recursion)
+        index, lowlink, stack, on_stack, cycles = {}, {}, [], set(), []
+
+        def visit(stmt_no):
+            index[stmt_no] = lowlink[stmt_no] = len(index)
+            stack.append(stmt_no)
+            on_stack.add(stmt_no)
+            return stmt_no, iter(self._edges(stmt_no))
+
+        for root in self.conditions:
+            if root in index:
+                continue
+            work = [visit(root)]
+            while len(work) > 0:
+                stmt_no, edges = work[-1]
+                for target in edges:
+                    if target not in index:
+                        work.append(visit(target))
+                        break
+                    if target in on_stack:
+                        lowlink[stmt_no] = min(lowlink[stmt_no], index[target])
+                else:
+                    work.pop()
+                    if len(work) > 0:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[stmt_no])
+                    if lowlink[stmt_no] == index[stmt_no]:
+                        component = [stack.pop()]
+                        while component[-1] != stmt_no:
+                            component.append(stack.pop())
+                        on_stack.difference_update(component)
+                        if len(component) > 1 or stmt_no in self._edges(stmt_no):
+                            cycles.append(
+                                [s for s in self.conditions if s in component]
+                            )
+        return cycles
+
+    def order(self):
+        # topological order, ties broken by sheet order; statements on a
+        # cycle, or depending on one, have none and come last in sheet order
+        stmt_nos = list(self.conditions)
+        position = {stmt_no: i for i, stmt_no in enumerate(stmt_nos)}
+        dependents = defaultdict(list)
+        pending = {}
+        for stmt_no in stmt_nos:
+            edges = self._edges(stmt_no)
+            pending[stmt_no] = len(edges)
+            for dependency in edges:
+                dependents[dependency].append(stmt_no)
+        ready = [position[s] for s in stmt_nos if pending[s] == 0]
+        order = []
+        while len(ready) > 0:
+            stmt_no = stmt_nos[heapq.heappop(ready)]
+            order.append(stmt_no)
+            for dependent in dependents[stmt_no]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    heapq.heappush(ready, position[dependent])
+        ordered = set(order)
+        return order + [s for s in stmt_nos if s not in ordered]
+
+    def _edges(self, stmt_no):
+        # dependencies that have a condition themselves
+        return [s for s in self.dependencies(stmt_no) if s in self.conditions]
+
+
+class AncestorClosure(dict):
+    # class -> frozenset of the classes it is a subclass of, itself included.
+    # Filled once the classes exist, so subclass tests while generating rules
+    # are set lookups; classes created later are added on first use.
+    def __init__(self, classes=()):
+        super().__init__((cls, frozenset(cls.__mro__)) for cls in classes)
+
+    def __missing__(self, cls):
+        ancestors = self[cls] = frozenset(cls.__mro__)
+        return ancestors
+
+
+def _check_subclasses(a, b, ancestors):
     if a is None or b is None:
         return False
-    return a == b or issubclass(a, b) or issubclass(b, a)
-
-
-def get_rule(sub, rel, obj, concl_sub, concl_rel, concl_obj, negation=False):
-    s1, s2, o1, o2 = "?x", "?y", "?z", "?q"
-    if _check_subclasses(sub, concl_sub):
-        s1 = s2
-    if _check_subclasses(sub, concl_obj):
-        s1 = o2
-    if _check_subclasses(obj, concl_obj):
-        o1 = o2
-    if _check_subclasses(obj, concl_sub):
-        o1 = s2
-    if rel is not None:
-        rule = f"{sub.name}({s1}), {obj.name}({o1}), {concl_sub.name}({s2}), {concl_obj.name}({o2}), {rel}({s1}, {o1}) -> {concl_rel}({s2},{o2})"
-    else:
-        rule = f"{sub.name}({s1}), {concl_sub.name}({s2}), {concl_obj.name}({o2}) -> {concl_rel}({s2},{o2})"
-    return rule
-
-
-def get_rules_from_statements(
-    activation_condition_stmt_no, colclusion_stmt_no, negation=False
-):
-    logger.debug("get_rules_from_statements")
-    rules = []
-    conclusion_relations = ig.statement_no_to_realtion[colclusion_stmt_no]
-    activation_relations = ig.statement_no_to_realtion[activation_condition_stmt_no]
-    if len(conclusion_relations) == 0:
-        logger.warning(
-            f"No conclusion relations found for statement({colclusion_stmt_no})"
-        )
-    if len(activation_relations) == 0:
+    return a == b or b in ancestors[a] or a in ancestors[b]
+
+
+def get_rule(activations, concl_sub, concl_rel, concl_obj, ancestors=None):
+    # activations: (subject, relation, object) of each conjoined activation
+    # statement; relation and object are None for a constituted subclass
+    if ancestors is None:
+        ancestors = AncestorClosure()
+    s2, o2 = "?y", "?q"
+    classes, relations = [], []
+    for i, (sub, rel, obj) in enumerate(activations):
+        s1, o1 = ("?x", "?z") if i == 0 else (f"?x{i}", f"?z{i}")
+        if _check_subclasses(sub, concl_sub, ancestors):
+            s1 = s2
+        if _check_subclasses(sub, concl_obj, ancestors):
+            s1 = o2
+        if _check_subclasses(obj, concl_obj, ancestors):
+            o1 = o2
+        if _check_subclasses(obj, concl_sub, ancestors):
+            o1 = s2
+        classes.append(f"{sub.name}({s1})")
+        if rel is not None:
+            classes.append(f"{obj.name}({o1})")
+            relations.append(f"{rel}({s1}, {o1})")
+    body = [*classes, f"{concl_sub.name}({s2})", f"{concl_obj.name}({o2})", *relations]
+    return f"{', '.join(body)} -> {concl_rel}({s2},{o2})"
+
+
+_atom_regex = re.compile(r"\s*([^\s()][^()]*)\(([^()]*)\)\s*(?:,|$)")
+
+
+def parse_rule(rule_str):
+    body, head = rule_str.split("->")
+    return _parse_atoms(body), _parse_atoms(head)
+
+
+def _parse_atoms(atoms_str):
+    return tuple(
+        (name, tuple(arg.strip() for arg in args.split(",")))
+        for name, args in _atom_regex.findall(atoms_str)
+    )
+
+
+def _canonical_rule(body, head):
+    # rules differing only in variable names are the same rule
+    variables = {}
+
+    def rename(arg):
+        if not arg.startswith("?"):
+            return arg
+        return variables.setdefault(arg, f"?v{len(variables)}")
+
+    return tuple(
+        tuple((name, tuple(rename(arg) for arg in args)) for name, args in atoms)
+        for atoms in (body, head)
+    )
+
+
+def format_rule(body, head):
+    return " -> ".join(
+        ", ".join(f"{name}({', '.join(args)})" for name, args in atoms)
+        for atoms in (body, head)
+    )
+
+
+class RuleBatch:
+    def __init__(self):
+        self.rules = {}
+        # canonical rule -> Imp for the rules already in the ontology
+        self.inserted = {}
+        # canonical rule -> (activation, conclusion) statement pairs it comes from
+        self.sources = defaultdict(set)
+        self.generated = 0
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, rule_str, *sources):
+        # sources: (activation, conclusion) statement pairs
+        self.generated += 1
+        body, head = parse_rule(rule_str)
+        key = _canonical_rule(body, head)
+        self.sources[key].update(sources)
+        if key in self.rules or key in self.inserted:
+            logger.debug(f"skipping duplicated rule: {rule_str}")
+        else:
+            logger.debug(f"adding rule: {rule_str}")
+            self.rules[key] = (body, head)
+
+    def insert(self, onto):
+        import owlready2
+
+        entities = {}
+        variables = {}
+
+        def get_entity(name):
+            entity = entities.get(name)
+            if entity is None:
+                entity = onto[name]
+                if entity is None:
+                    raise ValueError(f"Cannot find entity '{name}'!")
+                entities[name] = entity
+            return entity
+
+        def create_atoms(rule, atoms):
+            created = []
+            for name, args in atoms:
+                entity = get_entity(name)
+                if isinstance(entity, owlready2.ThingClass):
+                    atom = owlready2.ClassAtom(class_predicate=entity)
+                else:
+                    atom = owlready2.IndividualPropertyAtom(property_predicate=entity)
+                arguments = []
+                for arg in args:
+                    if arg not in variables:
+                        variables[arg] = rule.get_variable(arg)
+                    arguments.append(variables[arg])
+                atom.arguments = arguments
+                created.append(atom)
+            return created
+
+        with onto:
+            for key, (body, head) in self.rules.items():
+                rule = owlready2.Imp()
+                rule.body = create_atoms(rule, body)
+                rule.head = create_atoms(rule, head)
+                self.inserted[key] = rule
         logger.info(
-            f"No activation relations found for statement ({activation_condition_stmt_no}). Checking subclasses"
+            f"Added {len(self.rules)} distinct rules ({self.generated} generated)"
         )
-        subclass_subj = ig.statement_no_to_constituted_subclass[
-            activation_condition_stmt_no
-        ]["default"]
-        relation = None
-    else:
-        subclass_subj = None
-
-    for concl_subj, concl_rel, concl_obj in conclusion_relations:
-        if subclass_subj is None:
-            for subj, relation, obj in activation_relations:
-                rules.append(
-                    get_rule(
-                        subj,
-                        relation,
-                        obj,
-                        concl_subj,
-                        concl_rel,
-                        concl_obj,
-                        negation=negation,
-                    )
+        self.rules.clear()
+        self.generated = 0
+
+    def retract(self, conclusion_stmt_nos):
+        # drops rules concluding in the given statements, unless other
+        # statements still produce them
+        import owlready2
+
+        for key in list(self.inserted):
+            sources = self.sources.get(key, set())
+            retracted = {s for s in sources if s[1] in conclusion_stmt_nos}
+            if len(retracted) == 0:
+                continue
+            if retracted == sources:
+                owlready2.destroy_entity(self.inserted.pop(key))
+                del self.sources[key]
+            else:
+                sources -= retracted
+
+
+class RuleStages:
+    # Activation condition rule stages of OntologyBuilder. Rules are collected
+    # in self.rule_batch and added to self.onto by flush_rules.
+
+    def get_rules_from_statements(self, activation_stmt_nos, conclusion_stmt_no):
+        # rules concluding in conclusion_stmt_no when all the activation
+        # statements apply
+        logger.debug("get_rules_from_statements")
+        conclusion_relations = self.statement_no_to_realtion.get(conclusion_stmt_no, [])
+        if len(conclusion_relations) == 0:
+            logger.warning(
+                f"No conclusion relations found for statement({conclusion_stmt_no})"
+            )
+        activations = []
+        for stmt_no in activation_stmt_nos:
+            relations = self.statement_no_to_realtion.get(stmt_no, [])
+            if len(relations) == 0:
+                logger.info(
+                    f"No activation relations found for statement ({stmt_no}). Checking subclasses"
                 )
-        else:
-            rules.append(
-                get_rule(
-                    subclass_subj,
-                    None,
-                    None,
-                    concl_subj,
-                    concl_rel,
-                    concl_obj,
-                    negation=negation,
+                subclass = self.statement_no_to_constituted_subclass.lookup(
+                    stmt_no, "default"
                 )
-            )
+                relations = [(subclass, None, None)]
+            activations.append(relations)
 
-    for rule in rules:
-        add_rule(rule)
-
-
-def add_rule(rule_str):
-    logger.info(f"adding rule: {rule_str}")
-    with ig.onto:
-        rule = owlready2.Imp()
-        rule.set_as_rule(rule_str)
-
-
-def define_rules(act_cond, stmt_no, negation=False):
-    if act_cond == "":
-        return
-    act_cond = get_act_cond(act_cond)
-    if type(act_cond) == list:
-        for a_cond in act_cond:
-            define_rules(a_cond, stmt_no)
-    else:
-        if act_cond[:3] == "NOT":
-            ...
-            # TODO
-        #             act_cond = act_cond.strip("NOT ")
-        #             define_rules(act_cond, stmt_no, negation=(not negation))
-        else:
-            # act_cond = float(act_cond)
-            get_rules_from_statements(act_cond, stmt_no, negation=negation)
+        sources = [(stmt_no, conclusion_stmt_no) for stmt_no in activation_stmt_nos]
+        for concl_subj, concl_rel, concl_obj in conclusion_relations:
+            for combination in itertools.product(*activations):
+                rule = get_rule(
+                    combination, concl_subj, concl_rel, concl_obj, self.ancestors
+                )
+                self.add_rule(rule, *sources)
+
+    def add_rule(self, rule_str, *sources):
+        self.rule_batch.add(rule_str, *sources)
+
+    def flush_rules(self):
+        self.metrics.count("rules_generated", self.rule_batch.generated)
+        self.metrics.count("rules_added", len(self.rule_batch))
+        self.rule_batch.insert(self.onto)
+
+    def known_statements(self):
+        # statements an activation condition can refer to
+        return {s for s, r in self.statement_no_to_realtion.items() if len(r) > 0} | {
+            s
+            for s, subclasses in self.statement_no_to_constituted_subclass.items()
+            if "default" in dict(subclasses)
+        }
 
+    def condition_graph(self, *conditions):
+        # conditions: (statement number, activation condition reference) pairs
+        graph = ConditionGraph()
+        for pairs in conditions:
+            for stmt_no, act_cond in pairs:
+                graph.add(stmt_no, act_cond)
+        if len(graph.invalid) > 0:
+            self.metrics.count("invalid_activation_conditions", len(graph.invalid))
+        for cycle in graph.cycles():
+            logger.warning(f"Cyclic activation conditions: {cycle}")
+            self.metrics.count("activation_condition_cycles")
+        dangling = graph.dangling(self.known_statements())
+        for stmt_no, missing in dangling.items():
+            logger.warning(
+                f"Activation condition of statement {stmt_no} references "
+                f"statements without relations or classes: {missing}"
+            )
+            self.metrics.count("dangling_references", len(missing))
+        return graph, dangling
+
+    def define_rules(self, condition, stmt_no, missing=()):
+        # missing: referenced statements without relations or classes
+        for conjunction in disjunctive_form(condition):
+            if any(negated for _, negated in conjunction):
+                # SWRL rule bodies cannot express that a statement does not apply
+                logger.warning(
+                    f"Skipping negated activation condition of statement {stmt_no}"
+                )
+                self.metrics.count("rules_skipped", reason="negation")
+                continue
+            activation_stmt_nos = [s for s, _ in conjunction]
+            if any(s in missing for s in activation_stmt_nos):
+                self.metrics.count("rules_skipped", reason="dangling_reference")
+                continue
+            self.get_rules_from_statements(activation_stmt_nos, stmt_no)
 
-def define_activation_condition_rules_from_df(df):
-    for act_cond, stmt_no in zip(df[ig.ACT_COND_REF], df[ig.STMT_NO]):
-        define_rules(act_cond, stmt_no)
+    def define_activation_condition_rules(self, graph, dangling, stmt_nos):
+        # in dependency order, a statement after the statements it builds on
+        for stmt_no in graph.order():
+            if stmt_no in stmt_nos:
+                self.define_rules(
+                    graph.conditions[stmt_no], stmt_no, dangling.get(stmt_no, ())
+                )
@@ -0,0 +1,168 @@
+import functools
+import gzip
+import io
+import re
+from urllib.parse import urljoin
+
+# Line based serializations of an ontology, streamed from the owlready2
+# quadstore instead of building the RDF/XML document in memory.
+
+output_formats = ["rdfxml", "ntriples", "turtle"]
+# N-Triples has absolute IRIs only, the relative class IRIs are resolved
+# against this base unless another one is given
+default_base = "http://example.org/"
+extensions = {".nt": "ntriples", ".ttl": "turtle"}
+
+prefixes = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "swrl": "http://www.w3.org/2003/11/swrl#",
+}
+rdf_type = prefixes["rdf"] + "type"
+# local names written as prefixed names, anything else stays a full IRI
+local_name_regex = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+
+# s, p, o, d with the IRIs of the resources they refer to; d is NULL for
+# objects, 0 for plain literals, "@lang" or a datatype storid otherwise
+triples_query = """
+    SELECT q.s, rs.iri, rp.iri, q.o, ro.iri, q.d, rd.iri
+    FROM quads q
+    LEFT JOIN resources rs ON rs.storid = q.s
+    JOIN resources rp ON rp.storid = q.p
+    LEFT JOIN resources ro ON q.d IS NULL AND ro.storid = q.o
+    LEFT JOIN resources rd ON rd.storid = q.d
+    WHERE q.c = ?
+"""
+orderings = {
+    # sorting happens in SQLite, which spills to temporary files when needed
+    "sorted": " ORDER BY rs.iri IS NOT NULL, rs.iri, q.s, rp.iri, ro.iri, q.o, q.d",
+    "subject": " ORDER BY q.s",
+    None: "",
+}
+
+
+def detect_output_format(output_path):
+    # "ig.nt", "ig.ttl" or "ig.nt.gz", RDF/XML for anything else
+    path = output_path[:-3] if output_path.endswith(".gz") else output_path
+    for extension, output_format in extensions.items():
+        if path.endswith(extension):
+            return output_format
+    return "rdfxml"
+
+
+def escape_literal(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def iter_triples(onto, ordering=None, base=None):
+    # (subject, predicate, object) as N-Triples terms; relative IRIs such as
+    # the default "ig.onto.owl#..." are resolved against base when given
+    iri = functools.lru_cache(None)(lambda i: urljoin(base, i)) if base else str
+    cursor = onto.world.graph.db.cursor()
+    cursor.execute(triples_query + orderings[ordering], (onto.graph.c,))
+    for s, s_iri, p_iri, o, o_iri, d, d_iri in cursor:
+        subject = f"_:{-s}" if s < 0 else f"<{iri(s_iri)}>"
+        if d is None:
+            obj = f"_:{-o}" if o < 0 else f"<{iri(o_iri)}>"
+        elif isinstance(d, str) and d.startswith("@"):
+            obj = f'"{escape_literal(o)}"{d}'
+        elif d == 0:
+            obj = f'"{escape_literal(o)}"'
+        else:
+            obj = f'"{escape_literal(o)}"^^<{d_iri}>'
+        yield subject, f"<{iri(p_iri)}>", obj
+
+
+def write_ntriples(onto, f, sort=False, base=default_base):
+    ordering = "sorted" if sort else None
+    f.writelines(f"{s} {p} {o} .\n" for s, p, o in iter_triples(onto, ordering, base))
+
+
+def write_turtle(onto, f, sort=False, base=default_base):
+    # relative IRIs stay relative, readers resolve them against @base
+    base_iri = onto.base_iri
+    namespaces = {**prefixes, "": base_iri}
+    lookup = {iri: prefix for prefix, iri in namespaces.items()}
+
+    @functools.lru_cache(None)
+    def shorten(term, predicate=False):
+        if not term.startswith("<"):
+            return term
+        iri = term[1:-1]
+        if predicate and iri == rdf_type:
+            return "a"
+        namespace, local_name = _split_iri(iri)
+        prefix = lookup.get(namespace)
+        if prefix is not None and local_name_regex.fullmatch(local_name):
+            return f"{prefix}:{local_name}"
+        return term
+
+    if base:
+        f.write(f"@base <{base}> .\n")
+    for prefix, iri in namespaces.items():
+        f.write(f"@prefix {prefix}: <{iri}> .\n")
+    # triples of a subject are consecutive, written as one statement
+    subject = None
+    for s, p, o in iter_triples(onto, "sorted" if sort else "subject"):
+        if s != subject:
+            if subject is not None:
+                f.write(" .\n")
+            f.write(f"\n{shorten(s)} {shorten(p, True)} {shorten(o)}")
+            subject = s
+        else:
+            f.write(f" ;\n    {shorten(p, True)} {shorten(o)}")
+    if subject is not None:
+        f.write(" .\n")
+
+
+def _split_iri(iri):
+    split_at = max(iri.rfind("#"), iri.rfind("/")) + 1
+    return iri[:split_at], iri[split_at:]
+
+
+def resolve_output_format(output, output_format=None, sort=False, base=None):
+    if output_format is None:
+        output_format = (
+            detect_output_format(output) if isinstance(output, str) else "rdfxml"
+        )
+    if output_format not in output_formats:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if output_format == "rdfxml" and (sort or base):
+        raise ValueError("sort and base are only available for ntriples and turtle")
+    return output_format
+
+
+def save_ontology(onto, output, output_format=None, sort=False, base=None):
+    # output is a path or a binary file; a path ending in .gz is gzip
+    # compressed. RDF/XML is written by owlready2, in store order only.
+    output_format = resolve_output_format(output, output_format, sort, base)
+    if base is None:
+        base = default_base
+    if isinstance(output, str):
+        opener = gzip.open if output.endswith(".gz") else open
+        with opener(output, "wb") as f:
+            _write(onto, f, output_format, sort, base)
+    else:
+        _write(onto, output, output_format, sort, base)
+
+
+def _write(onto, f, output_format, sort, base):
+    if output_format == "rdfxml":
+        onto.save(f)
+        return
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="\n")
+    if output_format == "ntriples":
+        write_ntriples(onto, text, sort, base)
+    else:
+        write_turtle(onto, text, sort, base)
+    text.flush()
+    # leave f open for the caller
+    text.detach()
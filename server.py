@@ -0,0 +1,167 @@
+import io
+import logging
+import os
+import socketserver
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import typer
+
+from builder import OntologyBuilder
+from inflection import InflectionTable
+from preprocessing import check_annotations, detect_format, read_annotations
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+content_types = {
+    "rdfxml": "application/rdf+xml",
+    "ntriples": "application/n-triples",
+    "turtle": "text/turtle",
+}
+# the pool is created by main, request handlers submit builds to it
+pool = None
+
+
+def warm_up():
+    # lemminflect loads its inflection tables on first use
+    InflectionTable().prepare(["pay"])
+
+
+def build_ontology(
+    input_annotation_path,
+    input_format=None,
+    skiprows=1,
+    structured_provenance=False,
+    output_format="rdfxml",
+    sort=False,
+    base=None,
+):
+    df = read_annotations(input_annotation_path, input_format, skiprows)
+    check_annotations(df)
+    output = io.BytesIO()
+    with OntologyBuilder() as builder:
+        builder.build(df)
+        builder.save(output, structured_provenance, output_format, sort, base)
+    return output.getvalue()
+
+
+def build_payload(payload, input_format=None, skiprows=1, *options):
+    # the format of an uploaded sheet is detected from its contents, the file
+    # then gets the matching extension as openpyxl insists on it
+    fd, path = tempfile.mkstemp(prefix="ig-annotations-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        if input_format is None:
+            input_format = detect_format(path)
+        os.rename(path, f"{path}.{input_format}")
+        path = f"{path}.{input_format}"
+        return build_ontology(path, input_format, skiprows, *options)
+    finally:
+        os.remove(path)
+
+
+class BuildHandler(BaseHTTPRequestHandler):
+    # GET /health
+    # POST /build?path=<annotation file>, or the annotation file as the body
+    #   optional parameters: input_format, skiprows, structured_provenance,
+    #   output_format (rdfxml, ntriples or turtle), sort, base
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self.send_text(404, "Not found")
+        else:
+            self.send_text(200, "ok")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/build":
+            self.send_text(404, "Not found")
+            return
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            output_format = params.get("output_format", "rdfxml")
+            if output_format not in content_types:
+                raise ValueError(f"Unsupported output format: {output_format}")
+            options = (
+                params.get("input_format"),
+                int(params.get("skiprows", 1)),
+                params.get("structured_provenance", "") in ("1", "true", "yes"),
+                output_format,
+                params.get("sort", "") in ("1", "true", "yes"),
+                params.get("base"),
+            )
+            if "path" in params:
+                future = pool.submit(build_ontology, params["path"], *options)
+            else:
+                length = int(self.headers.get("Content-Length", 0))
+                if length == 0:
+                    raise ValueError("Expected a path parameter or a request body")
+                future = pool.submit(build_payload, self.rfile.read(length), *options)
+            ontology = future.result()
+        except (ValueError, KeyError, OSError) as e:
+            self.send_text(400, f"{type(e).__name__}: {e}")
+            return
+        except Exception as e:
+            logger.exception("Build failed")
+            self.send_text(500, f"{type(e).__name__}: {e}")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_types[output_format])
+        self.send_header("Content-Length", str(len(ontology)))
+        self.end_headers()
+        self.wfile.write(ontology)
+
+    def send_text(self, code, text):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket: Optional[str] = None,
+    processes: Optional[int] = None,
+):
+    global pool
+    pool = ProcessPoolExecutor(processes, initializer=warm_up)
+    # starts the workers now rather than on the first request
+    pool.submit(warm_up).result()
+    if socket is None:
+        server = ThreadingHTTPServer((host, port), BuildHandler)
+        logger.info(f"Listening on http://{host}:{port}")
+    else:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = UnixHTTPServer(socket, BuildHandler)
+        logger.info(f"Listening on {socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    typer.run(main)
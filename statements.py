@@ -0,0 +1,127 @@
+from collections import namedtuple
+
+import ig
+
+# Statements as records, to build without an annotation sheet. Every field
+# stands for the sheet column given in regulative_fields/constitutive_fields.
+
+regulative_fields = {
+    "stmt_no": ig.STMT_NO,
+    "statement_function": ig.STMT_FUNCTION,
+    "attribute": ig.ATTR,
+    "attribute_property": ig.ATTR_PROP,
+    "deontic": ig.DEON,
+    "aim": ig.AIM,
+    "direct_object": ig.DIR_OBJ,
+    "direct_object_property": ig.DIR_OBJ_PROP,
+    "indirect_object": ig.INDIR_OBJ,
+    "indirect_object_property": ig.INDIR_OBJ_PROP,
+    "activation_condition": ig.ACT_COND_REF,
+}
+constitutive_fields = {
+    "stmt_no": ig.STMT_NO,
+    "statement_function": ig.STMT_FUNCTION,
+    "entity": ig.ENT,
+    "entity_property": ig.ENT_PROP,
+    "modal": ig.MODAL,
+    "function": ig.FUN,
+    "constituted_property": ig.CON_PROP,
+    "constituted_property_property": ig.CON_PROP_PROP,
+    "activation_condition": ig.ACT_COND_REF,
+}
+
+# statement_function is "observation" for observations
+RegulativeStatement = namedtuple(
+    "RegulativeStatement",
+    list(regulative_fields),
+    defaults=["regulative"] + [""] * (len(regulative_fields) - 2),
+)
+ConstitutiveStatement = namedtuple(
+    "ConstitutiveStatement",
+    list(constitutive_fields),
+    defaults=["constitutive"] + [""] * (len(constitutive_fields) - 2),
+)
+
+# the statements each build stage reads
+kinds = ["constitutive", "observations", "regulative_observations", "regulative"]
+
+
+class FrameStatements:
+    # Statements of a normalized annotation table, by kind
+    def __init__(self, df):
+        from preprocessing import split_statements
+
+        constitutive, observations, reg_observations, regulative = split_statements(df)
+        self.frames = {
+            "constitutive": constitutive[constitutive[ig.ENT] != ""],
+            "observations": observations,
+            "regulative_observations": reg_observations,
+            "regulative": regulative,
+        }
+
+    def rows(self, kind, columns):
+        return self.frames[kind][columns].itertuples(index=False, name=None)
+
+    def column(self, kind, column):
+        return self.frames[kind][column]
+
+    def row_ids(self, kind):
+        return self.frames[kind].index
+
+
+class RecordStatements:
+    # Statement records, by kind, with the values of FrameStatements: None
+    # becomes "" and strings are stripped
+    def __init__(self, records=()):
+        self.records = {kind: [] for kind in kinds}
+        self.positions = {
+            "regulative": _positions(regulative_fields),
+            "constitutive": _positions(constitutive_fields),
+        }
+        self.positions["regulative_observations"] = self.positions["regulative"]
+        self.positions["observations"] = self.positions["constitutive"]
+        self.extend(records)
+
+    def extend(self, records):
+        for record in records:
+            if isinstance(record, RegulativeStatement):
+                observation = "regulative_observations"
+                kind = "regulative"
+            elif isinstance(record, ConstitutiveStatement):
+                observation = "observations"
+                kind = "constitutive"
+            else:
+                raise TypeError(f"Not a statement record: {record!r}")
+            record = record._make(
+                "" if value is None else str(value).strip() for value in record
+            )
+            if record.statement_function == "observation":
+                kind = observation
+            elif record.statement_function != kind:
+                raise ValueError(
+                    f"Statement function of {record.stmt_no} must be {kind} or "
+                    f"observation: {record.statement_function}"
+                )
+            elif kind == "constitutive" and record.entity == "":
+                continue
+            self.records[kind].append(tuple(record))
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+    def rows(self, kind, columns):
+        positions = [self.positions[kind][column] for column in columns]
+        return [tuple(record[p] for p in positions) for record in self.records[kind]]
+
+    def column(self, kind, column):
+        position = self.positions[kind][column]
+        return [record[position] for record in self.records[kind]]
+
+    def row_ids(self, kind):
+        # records have no sheet row, messages give the statement number
+        return self.column(kind, ig.STMT_NO)
+
+
+def _positions(fields):
+    # sheet column -> position in the record
+    return {column: position for position, column in enumerate(fields.values())}
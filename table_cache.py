@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever reading or normalize_annotations changes what they return,
+# so that tables cached by an older version are not used.
+preprocessing_version = 1
+default_max_bytes = 512 << 20
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TableCache:
+    # Normalized annotation tables in a directory, one file per input
+    # content, read options and preprocessing version. Stored as Parquet,
+    # as pickle when pyarrow is missing. Beyond max_bytes the least recently
+    # used tables are removed.
+    def __init__(self, directory, max_bytes=default_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        try:
+            import pyarrow  # noqa: F401
+
+            self.extension = ".parquet"
+        except ImportError:
+            self.extension = ".pickle"
+
+    def key(self, input_annotation_path, input_format, skiprows, sheets=None):
+        import pandas as pd
+
+        # pandas is part of the key as pickles do not load across versions
+        options = (
+            f"{input_format} {skiprows} {sheets} {preprocessing_version} "
+            f"{pd.__version__}"
+        )
+        digest = hashlib.blake2b(options.encode(), digest_size=8).hexdigest()
+        return f"{file_digest(input_annotation_path)}-{digest}"
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def get(self, key):
+        import pandas as pd
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            if self.extension == ".parquet":
+                df = pd.read_parquet(path)
+            else:
+                df = pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cached table {path}: {e}")
+            return None
+        # the modification time orders the tables for eviction
+        os.utime(path)
+        return df
+
+    def put(self, key, df):
+        path = self.path(key)
+        partial = f"{path}.partial"
+        if self.extension == ".parquet":
+            df.to_parquet(partial)
+        else:
+            df.to_pickle(partial, compression=None)
+        os.replace(partial, path)
+        self.evict()
+
+    def entries(self):
+        # (modification time, size, path), least recently used first
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith((".parquet", ".pickle")):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        # the newest table stays even when it alone is over the limit
+        for _, entry_size, path in entries[:-1]:
+            if size <= self.max_bytes:
+                break
+            logger.info(f"Evicting cached table {path}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # evicted by another build
+                pass
+            size -= entry_size
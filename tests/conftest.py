@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# the modules are top level ones in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def write_sheet(tmp_path):
+    # writes rows, dicts of sheet columns to values, as an annotation sheet
+    from benchmarks import generate
+
+    def write(rows, name="sheet.csv"):
+        path = str(tmp_path / name)
+        generate.write_sheet(
+            ([row.get(column, "") for column in generate.header] for row in rows),
+            path,
+        )
+        return path
+
+    return write
+
+
+@pytest.fixture(scope="session")
+def synthetic_sheet(tmp_path_factory):
+    # 1000 statements in the layout of the annotation template
+    from benchmarks import generate
+
+    path = str(tmp_path_factory.mktemp("synthetic") / "synthetic-1000.csv")
+    generate.write_sheet(generate.generate_rows(1000), path)
+    return path
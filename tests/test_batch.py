@@ -0,0 +1,44 @@
+import owlready2
+
+import batch
+import ig
+from builder import OntologyBuilder
+from preprocessing import read_annotations
+
+
+def test_class_created_before_its_parent(write_sheet):
+    # BankCentral is created as a base class, then as a subclass of Bank
+    path = write_sheet(
+        [
+            {
+                ig.CLASS: "regulative",
+                ig.STMT_FUNCTION: "regulative",
+                ig.STMT_NO: "1.1",
+                ig.ATTR: "bank central",
+                ig.DEON: "must",
+                ig.AIM: "publish",
+                ig.DIR_OBJ: "report",
+            },
+            {
+                ig.CLASS: "regulative",
+                ig.STMT_FUNCTION: "regulative",
+                ig.STMT_NO: "1.2",
+                ig.ATTR: "bank",
+                ig.ATTR_PROP: "central",
+                ig.DEON: "may",
+                ig.AIM: "issue",
+                ig.DIR_OBJ: "report",
+            },
+        ]
+    )
+    with OntologyBuilder() as builder:
+        builder.build(read_annotations(path))
+        expected = {c.name: [p.name for p in c.is_a] for c in builder.onto.classes()}
+    with OntologyBuilder() as builder:
+        batch.merge_document(builder, *batch.build_document(path))
+        merged = {c.name: [p.name for p in c.is_a] for c in builder.onto.classes()}
+        assert builder.class_index["BankCentral"].is_a == [
+            owlready2.Thing,
+            builder.class_index["Bank"],
+        ]
+    assert merged == expected
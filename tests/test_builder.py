@@ -0,0 +1,110 @@
+import asyncio
+
+import pandas as pd
+
+import ig
+from builder import OntologyBuilder
+from preprocessing import normalize_annotations, read_annotations
+from statements import (
+    ConstitutiveStatement,
+    RegulativeStatement,
+    constitutive_fields,
+    regulative_fields,
+)
+
+
+def table_of(records):
+    rows = []
+    for record in records:
+        if isinstance(record, RegulativeStatement):
+            fields, kind = regulative_fields, "regulative"
+        else:
+            fields, kind = constitutive_fields, "constitutive"
+        row = {column: value for column, value in zip(fields.values(), record)}
+        row[ig.CLASS] = kind
+        rows.append(row)
+    return normalize_annotations(pd.DataFrame(rows))
+
+
+def records_of(df):
+    for row in df.to_dict("records"):
+        if row[ig.CLASS] == "regulative":
+            yield RegulativeStatement(*(row[c] for c in regulative_fields.values()))
+        elif row[ig.CLASS] == "constitutive":
+            yield ConstitutiveStatement(*(row[c] for c in constitutive_fields.values()))
+
+
+def built(path, build):
+    with OntologyBuilder() as builder:
+        build(builder)
+        builder.save(path, sort=True)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+clashing_records = [
+    # the observation takes "grant", the constitutive relation "grant'"
+    ConstitutiveStatement(
+        "1", entity="court", function="grant", constituted_property="licence"
+    ),
+    RegulativeStatement(
+        "2",
+        statement_function="observation",
+        attribute="agency",
+        aim="grant",
+        direct_object="permit",
+    ),
+    # a subclass of Court only, as the entities are built first
+    RegulativeStatement(
+        "3",
+        attribute="court licence",
+        deontic="must",
+        aim="notify",
+        direct_object="agency",
+    ),
+    ConstitutiveStatement(
+        "4",
+        entity="court",
+        entity_property="licence",
+        function="is",
+        constituted_property="document",
+    ),
+]
+
+
+def test_records_build_as_table(tmp_path, synthetic_sheet):
+    df = read_annotations(synthetic_sheet)
+    records = clashing_records + list(records_of(df))
+    expected = built(
+        str(tmp_path / "table.nt"),
+        lambda builder: builder.build(table_of(records)),
+    )
+    result = built(
+        str(tmp_path / "records.nt"),
+        lambda builder: builder.build_records(iter(records)),
+    )
+    assert result == expected
+
+
+def test_stage_order_of_records():
+    with OntologyBuilder() as builder:
+        builder.build_records(iter(clashing_records))
+        assert sorted(c.name for c in builder.onto["grant"].domain) == ["Agency"]
+        assert sorted(c.name for c in builder.onto["grant'"].domain) == ["Court"]
+        assert builder.onto["CourtLicence"].is_a == [builder.onto["Court"]]
+
+
+def test_async_records_build_as_table(tmp_path):
+    async def records():
+        for record in clashing_records:
+            yield record
+
+    expected = built(
+        str(tmp_path / "table.nt"),
+        lambda builder: builder.build(table_of(clashing_records)),
+    )
+    result = built(
+        str(tmp_path / "records.nt"),
+        lambda builder: asyncio.run(builder.build_records_async(records())),
+    )
+    assert result == expected
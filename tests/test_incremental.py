@@ -0,0 +1,60 @@
+import csv
+import os
+import subprocess
+import sys
+
+import ig
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+update_script = """
+import sys
+
+import main
+
+v0, v1, store, output = sys.argv[1:]
+main.main(v0, output, incremental_store=store)
+main.main(v1, output, incremental_store=store)
+"""
+
+
+def write_changed_sheet(synthetic_sheet, path):
+    # changes the aim of every 20th statement and removes one
+    with open(synthetic_sheet, newline="", encoding="utf-8") as f:
+        title, header, *rows = csv.reader(f)
+    aim = header.index(ig.AIM)
+    for row in rows[::20]:
+        if row[aim] != "":
+            row[aim] += " again"
+    del rows[50]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([title, header, *rows])
+
+
+def updated_ontology(tmp_path, synthetic_sheet, seed):
+    changed_sheet = str(tmp_path / "changed.csv")
+    if not os.path.exists(changed_sheet):
+        write_changed_sheet(synthetic_sheet, changed_sheet)
+    output = str(tmp_path / f"{seed}.owl")
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            update_script,
+            synthetic_sheet,
+            changed_sheet,
+            str(tmp_path / f"{seed}.sqlite3"),
+            output,
+        ],
+        cwd=root,
+        env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        check=True,
+    )
+    with open(output, "rb") as f:
+        return f.read()
+
+
+def test_update_does_not_depend_on_hash_seed(tmp_path, synthetic_sheet):
+    assert updated_ontology(tmp_path, synthetic_sheet, 1) == updated_ontology(
+        tmp_path, synthetic_sheet, 2
+    )
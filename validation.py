@@ -0,0 +1,192 @@
+import json
+import os
+
+import pandas as pd
+
+import ig
+from rules import ConditionGraph, reference_regex, parse_condition
+
+# Annotation checks over the normalized table, without building the ontology.
+# Every check is a column mask; issues are reported per statement number.
+
+# data_index: 0-based position in the normalized table, which leaves out the
+# rows above the header, the header and blank rows, and puts the sheets read
+# together one after another; it is not the spreadsheet row number
+issue_columns = ["statement", "data_index", "check", "column", "value"]
+report_formats = ["csv", "json"]
+
+statement_functions = {
+    "constitutive": {"constitutive", "observation"},
+    "regulative": {"regulative", "observation"},
+}
+# content columns turned into class names, per IG syntax
+class_columns = {
+    "constitutive": [
+        ig.ENT,
+        ig.ENT_PROP,
+        ig.CON_FUNC,
+        ig.CON_PROP,
+        ig.CON_PROP_PROP,
+    ],
+    "regulative": [
+        ig.ATTR,
+        ig.ATTR_PROP,
+        ig.DIR_OBJ,
+        ig.DIR_OBJ_PROP,
+        ig.INDIR_OBJ,
+        ig.INDIR_OBJ_PROP,
+    ],
+}
+
+
+def _issues(df, mask, check, column=ig.STMT_NO):
+    selected = df.loc[mask]
+    return pd.DataFrame(
+        {
+            "statement": selected[ig.STMT_NO],
+            "data_index": selected.index,
+            "check": check,
+            "column": column,
+            "value": selected[column],
+        },
+        columns=issue_columns,
+    )
+
+
+def find_issues(df):
+    syntax = df[ig.CLASS].astype(str)
+    function = df[ig.STMT_FUNCTION].astype(str)
+    constitutive = syntax == "constitutive"
+    regulative = syntax == "regulative"
+    observation = function == "observation"
+    issues = [
+        _issues(df, df[ig.STMT_NO] == "", "missing_statement_no"),
+        _issues(
+            df,
+            df[ig.STMT_NO].duplicated() & (df[ig.STMT_NO] != ""),
+            "duplicated_statement_no",
+        ),
+        _issues(df, ~(constitutive | regulative), "unknown_syntax", ig.CLASS),
+        _issues(
+            df,
+            (constitutive & ~function.isin(statement_functions["constitutive"]))
+            | (regulative & ~function.isin(statement_functions["regulative"])),
+            "unknown_statement_function",
+            ig.STMT_FUNCTION,
+        ),
+        _issues(
+            df,
+            observation & (df[ig.ACT_COND] != ""),
+            "observation_with_activation_condition",
+            ig.ACT_COND,
+        ),
+    ]
+
+    for syntax_mask, columns in [
+        (constitutive, class_columns["constitutive"]),
+        (regulative, class_columns["regulative"]),
+    ]:
+        for column in columns:
+            illegal = df[column].str.contains(ig.illegal_regex)
+            issues.append(
+                _issues(df, syntax_mask & illegal, "illegal_and_reference", column)
+            )
+
+    # statements whose relations are skipped by the builder
+    constitutive_proper = constitutive & (function == "constitutive")
+    regulative_any = regulative & function.isin(statement_functions["regulative"])
+    issues += [
+        _issues(
+            df, constitutive_proper & (df[ig.ENT] == ""), "missing_subject", ig.ENT
+        ),
+        _issues(
+            df,
+            constitutive_proper & (df[ig.ENT] != "") & (df[ig.CON_PROP] == ""),
+            "missing_object",
+            ig.CON_PROP,
+        ),
+        _issues(df, regulative_any & (df[ig.ATTR] == ""), "missing_subject", ig.ATTR),
+        _issues(
+            df, regulative_any & (df[ig.DIR_OBJ] == ""), "missing_object", ig.DIR_OBJ
+        ),
+    ]
+
+    references = df[ig.ACT_COND_REF].str.findall(reference_regex).explode()
+    references = references[references.notna() & ~references.isin(["OR", "AND", "NOT"])]
+    dangling = references[~references.isin(set(df[ig.STMT_NO]))]
+    issues.append(
+        _issues(
+            df,
+            df.index.isin(dangling.index),
+            "dangling_reference",
+            ig.ACT_COND_REF,
+        )
+    )
+
+    issues += condition_issues(df)
+
+    issues = pd.concat(issues, ignore_index=True)
+    # grouped by statement, in sheet order
+    issues["first_index"] = issues.groupby("statement")["data_index"].transform("min")
+    issues = issues.sort_values(["first_index", "data_index"], kind="mergesort")
+    return issues.drop(columns="first_index").reset_index(drop=True)
+
+
+def condition_issues(df):
+    references = df[ig.ACT_COND_REF]
+    invalid = set()
+    for act_cond in references.unique():
+        try:
+            parse_condition(act_cond)
+        except ValueError:
+            invalid.add(act_cond)
+    invalid.discard("")
+    graph = ConditionGraph()
+    for act_cond, stmt_no in zip(references, df[ig.STMT_NO]):
+        if act_cond not in invalid:
+            graph.add(stmt_no, act_cond)
+    on_cycle = {stmt_no for cycle in graph.cycles() for stmt_no in cycle}
+    return [
+        _issues(
+            df,
+            references.isin(invalid),
+            "invalid_activation_condition",
+            ig.ACT_COND_REF,
+        ),
+        _issues(
+            df,
+            df[ig.STMT_NO].isin(on_cycle) & (references != ""),
+            "activation_condition_cycle",
+            ig.ACT_COND_REF,
+        ),
+    ]
+
+
+def summarize(issues):
+    return issues["check"].value_counts().sort_index().to_dict()
+
+
+def resolve_report_format(report_path, report_format=None):
+    if report_format is None:
+        report_format = os.path.splitext(report_path)[1].lstrip(".").lower()
+    if report_format not in report_formats:
+        raise ValueError(f"Unsupported report format: {report_format}")
+    return report_format
+
+
+def write_report(issues, report_path, report_format=None, source=None):
+    report_format = resolve_report_format(report_path, report_format)
+    if report_format == "csv":
+        issues.to_csv(report_path, index=False)
+    else:
+        statements = {}
+        for issue in issues.to_dict(orient="records"):
+            statements.setdefault(issue.pop("statement"), []).append(issue)
+        report = {
+            "source": source,
+            "issues": len(issues),
+            "counts": summarize(issues),
+            "statements": statements,
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=int)